@@ -4,50 +4,100 @@ Stops with the same name are allowed a higher distance to be walkable.
 """
 
 
-from concurrent.futures import ThreadPoolExecutor, wait
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Generator
-from threading import Lock
 
-from gtfs_kit.feed import read_feed
 import geopandas as gp
 import numpy as np
 import pandas as pd
+from scipy.spatial import cKDTree
+
+from gtfs_io import read_table
+from hashing import file_hash
+
+
+FEED_FILE = Path("data/20230109_fahrplaene_gesamtdeutschland_gtfs.zip")
+GERMANY_FILE = Path("data/germany.geojson")
+CACHE_DIR = Path("data/cache")
+
+WALKING_SPEED = 1.111111  # m/s
+MIN_TRANSFER_TIME = 120  # s
 
 
 def load_feed():
-    DATA_DIR = Path("data").absolute()
-    gtfs_de = read_feed(
-        DATA_DIR / "20230109_fahrplaene_gesamtdeutschland_gtfs.zip", "m"
-    )
-    gtfs_de.stops["geometry"] = gp.points_from_xy(
-        gtfs_de.stops.stop_lon, gtfs_de.stops.stop_lat
+    stops = read_table(FEED_FILE, "stops")
+    gdf_stops = gp.GeoDataFrame(
+        stops,
+        geometry=gp.points_from_xy(stops.stop_lon, stops.stop_lat),
+        crs="EPSG:4326",
     )
-    gdf_stops = gp.GeoDataFrame(gtfs_de.stops.copy(), geometry="geometry")
-    gdf_stops.crs = "EPSG:4326"
     gdf_stops.to_crs("EPSG:25832", inplace=True)
-    del gtfs_de
     return gdf_stops
 
 
-def limit_to_germany(gdf_stops: gp.GeoDataFrame):
-    gdf_germany = gp.read_file("data/germany.geojson")
+def limit_to_germany(
+    gdf_stops: gp.GeoDataFrame, buffer: float = 1000, tolerance: float = 100
+) -> gp.GeoDataFrame:
+    """
+    Keep stops within `buffer` metres of Germany. The boundary is simplified by
+    `tolerance` metres before buffering and tested against the stops' spatial
+    index. The resulting stop ids are cached per feed and boundary file.
+    """
+    cache_file = CACHE_DIR / (
+        f"germany_stops_{file_hash(FEED_FILE)[:16]}"
+        f"_{file_hash(GERMANY_FILE)[:16]}_{buffer:g}_{tolerance:g}.txt"
+    )
+
+    if cache_file.exists():
+        print(f"Using cached stops from {cache_file}")
+        stop_ids = cache_file.read_text(encoding="utf-8").splitlines()
+        return gdf_stops[gdf_stops["stop_id"].isin(stop_ids)]
+
+    gdf_germany = gp.read_file(GERMANY_FILE)
     gdf_germany = gdf_germany.to_crs("EPSG:25832")
-    gdf_stops = gdf_stops[gdf_stops.within(gdf_germany.unary_union.buffer(1000))]
+    boundary = gdf_germany.unary_union.simplify(tolerance).buffer(buffer)
+
+    idx = gdf_stops.sindex.query(boundary, predicate="contains")
+    gdf_stops = gdf_stops.iloc[np.sort(idx)]
+
+    CACHE_DIR.mkdir(exist_ok=True)
+    cache_file.write_text("\n".join(gdf_stops["stop_id"]), encoding="utf-8")
+
     return gdf_stops
 
 
-def get_nearby_stops(
-    gdf_stops: gp.GeoDataFrame, row: pd.Series, radius: float = 500
+def find_pairs_within(gdf_stops: gp.GeoDataFrame, radius: float) -> np.ndarray:
+    """
+    Find all pairs of stops closer than `radius` (including each stop with
+    itself and both directions) as a structured array with fields i, j and v.
+    """
+    coords = np.column_stack([gdf_stops.geometry.x, gdf_stops.geometry.y])
+    tree = cKDTree(coords)
+
+    pairs = tree.sparse_distance_matrix(tree, radius, output_type="ndarray")
+    pairs = pairs[pairs["v"] < radius]
+    pairs.sort(order=["i", "j"])
+    return pairs
+
+
+def to_transfers(
+    from_stop_ids: np.ndarray, to_stop_ids: np.ndarray, distances: np.ndarray
 ) -> pd.DataFrame:
-    stop_location = (
-        row.geometry
-    )  # gdf_stops[gdf_stops["stop_id"] == stop_id]["geometry"].values[0]
-    copy_df = gdf_stops[["stop_id", "geometry"]].copy()
-    copy_df["distance"] = gdf_stops.distance(stop_location)
-    result_df = copy_df[(copy_df["distance"] < radius)][["stop_id", "distance"]].copy()
-    del copy_df
-    return result_df
+    """Build the transfer rows for all given stop pairs at once."""
+    # Convert distance to walking time @ 1.11 m/s
+    min_transfer_time = np.maximum(
+        np.ceil(distances / WALKING_SPEED), MIN_TRANSFER_TIME
+    )
+    return pd.DataFrame(
+        {
+            "from_stop_id": from_stop_ids,
+            "to_stop_id": to_stop_ids,
+            "transfer_type": 2,
+            "min_transfer_time": min_transfer_time,
+        }
+    )
 
 
 def generate_transfers(
@@ -61,7 +111,7 @@ def generate_transfers(
             print("\n\n Skipping empty chunk")
             continue
         print(f"\n\nProcessing chunk {chunk.total_bounds}...")
-        dfs_transfers.extend(generate_for_chunk(chunk, radius))
+        dfs_transfers.append(generate_for_chunk(chunk, radius))
 
     df_transfers = pd.concat(dfs_transfers)
 
@@ -79,76 +129,101 @@ def generate_transfers(
     return df_transfers
 
 
-def generate_for_chunk(
-    chunk: pd.DataFrame, radius: float
-) -> Generator[pd.DataFrame, None, None]:
-    chunk_size = len(chunk)
-    # chunk_shrinking = chunk.copy()
-    for i, row in enumerate(chunk.itertuples()):
-        print(f"{i + 1}/{chunk_size}", end="\r")
-        nearby_stops = get_nearby_stops(chunk, row, radius)
-        if len(nearby_stops) == 0:
-            continue
-
-        nearby_stops["from_stop_id"] = row.stop_id
-        nearby_stops["transfer_type"] = 2
-
-        # Convert distance to walking time @ 1.11 m/s
-        nearby_stops["distance"] /= 1.111111
-        nearby_stops.rename(
-            columns={
-                "stop_id": "to_stop_id",
-                "distance": "min_transfer_time",
-            },
-            inplace=True,
-        )
-        nearby_stops["min_transfer_time"] = np.ceil(nearby_stops["min_transfer_time"])
-        nearby_stops.loc[
-            nearby_stops["min_transfer_time"] < 120, ["min_transfer_time"]
-        ] = 120
-
-        # Reorder columns
-        nearby_stops = nearby_stops[
-            [
-                "from_stop_id",
-                "to_stop_id",
-                "transfer_type",
-                "min_transfer_time",
-            ]
-        ]
-
-        yield nearby_stops
-
-        # Drop rows with same stop_id
-        # chunk_shrinking = chunk_shrinking[chunk_shrinking["stop_id"] != row.stop_id]
-
+def generate_transfers_kdtree(
+    gdf_stops: gp.GeoDataFrame, radius: float = 500
+) -> pd.DataFrame:
+    """
+    Generate the same transfers as `generate_transfers` using a single KD-tree
+    query over all stops instead of overlapping tiles.
+    """
+    df_transfers = generate_for_chunk(gdf_stops, radius)
+    df_transfers.drop_duplicates(["from_stop_id", "to_stop_id"], inplace=True)
+    return df_transfers
 
-def generate_transfers_to_same_name(gdf_stops: gp.GeoDataFrame):
-    stop_names = gdf_stops["stop_name"].unique()
-    executor = ThreadPoolExecutor(max_workers=32)
-    extend_lock = Lock()
 
-    futures = []
-    dfs_transfers = []
+def generate_for_chunk(chunk: pd.DataFrame, radius: float) -> pd.DataFrame:
+    pairs = find_pairs_within(chunk, radius)
+    stop_ids = chunk["stop_id"].to_numpy()
+    return to_transfers(stop_ids[pairs["i"]], stop_ids[pairs["j"]], pairs["v"])
 
-    for stop_name in stop_names:
 
-        def proc(stop_name):
-            print(f"Processing {stop_name}")
-            stops = gdf_stops[gdf_stops["stop_name"] == stop_name]
-            if len(stops) == 1:
-                return
+def pairs_in_group(coords: np.ndarray, radius: float) -> np.ndarray:
+    """Find all pairs within `radius` for the coordinates of a single group."""
+    tree = cKDTree(coords)
+    pairs = tree.sparse_distance_matrix(tree, radius, output_type="ndarray")
+    return pairs[pairs["v"] < radius]
 
-            dfs = list(generate_for_chunk(stops, radius=1000))
-            with extend_lock:
-                dfs_transfers.extend(dfs)
 
-        futures.append(executor.submit(proc, stop_name))
-
-    wait(futures)
+def generate_transfers_to_same_name(
+    gdf_stops: gp.GeoDataFrame,
+    radius: float = 1000,
+    heavy_group_size: int = 500,
+    processes: int | None = None,
+) -> pd.DataFrame:
+    """
+    Generate transfers between stops with the same name that are closer than
+    `radius`. Stops are partitioned by name once. Groups up to `heavy_group_size`
+    are paired in a single vectorized pass, larger groups get their own KD-tree
+    (in a process pool if `processes` is given).
+    """
+    x = gdf_stops.geometry.x.to_numpy()
+    y = gdf_stops.geometry.y.to_numpy()
+    stop_ids = gdf_stops["stop_id"].to_numpy()
+
+    groups = [
+        idx for idx in gdf_stops.groupby("stop_name").indices.values() if len(idx) > 1
+    ]
+    small = [idx for idx in groups if len(idx) <= heavy_group_size]
+    heavy = [idx for idx in groups if len(idx) > heavy_group_size]
+    print(f"{len(small)} groups, {len(heavy)} heavy groups")
+
+    from_idx = []
+    to_idx = []
+    distances = []
+
+    # all pairs of all small groups at once
+    if small:
+        members = np.concatenate(small)
+        sizes = np.array([len(idx) for idx in small])
+        group_starts = np.repeat(np.cumsum(sizes) - sizes, sizes)
+        group_sizes = np.repeat(sizes, sizes)
+
+        left = np.repeat(np.arange(len(members)), group_sizes)
+        pair_starts = np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+        right = (
+            np.repeat(group_starts, group_sizes) + np.arange(len(left)) - pair_starts
+        )
 
-    executor.shutdown(wait=True)
-    return pd.concat(dfs_transfers)
+        i = members[left]
+        j = members[right]
+        d = np.hypot(x[i] - x[j], y[i] - y[j])
+        keep = d < radius
+        from_idx.append(i[keep])
+        to_idx.append(j[keep])
+        distances.append(d[keep])
+
+    # heavy groups one by one
+    if heavy:
+        coords = [np.column_stack([x[idx], y[idx]]) for idx in heavy]
+        if processes:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(
+                    executor.map(pairs_in_group, coords, [radius] * len(coords))
+                )
+        else:
+            results = [pairs_in_group(c, radius) for c in coords]
+
+        for idx, pairs in zip(heavy, results):
+            from_idx.append(idx[pairs["i"]])
+            to_idx.append(idx[pairs["j"]])
+            distances.append(pairs["v"])
+
+    if not from_idx:
+        return to_transfers(stop_ids[:0], stop_ids[:0], np.empty(0))
+
+    from_idx = np.concatenate(from_idx)
+    to_idx = np.concatenate(to_idx)
+    return to_transfers(stop_ids[from_idx], stop_ids[to_idx], np.concatenate(distances))
 
 
 def chunked_stops(
@@ -167,17 +242,35 @@ def chunked_stops(
 
 
 def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--same-name-all-stops",
+        action="store_true",
+        help="generate same name transfers for all stops, not only those in Germany",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="number of processes for heavy same name groups",
+    )
+    args = parser.parse_args()
+
     print("Loading feed...")
     gdf_stops = load_feed()
     print("Limiting to Germany...")
     gdf_stops_de = limit_to_germany(gdf_stops)
     print("Generating transfers...")
-    df_transfers = generate_transfers(gdf_stops_de, radius=250, chunk_size=25_000)
+    df_transfers = generate_transfers_kdtree(gdf_stops_de, radius=250)
     print("Writing transfers...")
     df_transfers.to_csv("data/new_transfers.csv", index=False)
 
     print("Generating transfers to same name...")
-    df_transfers_same_name = generate_transfers_to_same_name(gdf_stops)
+    df_transfers_same_name = generate_transfers_to_same_name(
+        gdf_stops if args.same_name_all_stops else gdf_stops_de,
+        radius=1000,
+        processes=args.processes,
+    )
     df_transfers_same_name.to_csv("data/new_transfers_same_name.csv", index=False)
 
 
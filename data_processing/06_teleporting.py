@@ -4,68 +4,85 @@ Usually these lead to very unrealistic routes.
 """
 
 
+from argparse import ArgumentParser
 from pathlib import Path
 
-from gtfs_kit.feed import read_feed, Feed
 import geopandas as gp
+import numpy as np
 import pandas as pd
 
+from gtfs_io import read_tables
+
+
+FEED_FILE = Path("data/20230109_fahrplaene_gesamtdeutschland_gtfs.zip")
+
+MAX_TRANSFER_DISTANCE = 1000  # m
+
 
 def load_feed():
-    DATA_DIR = Path("data").absolute()
-    gtfs_de = read_feed(
-        DATA_DIR / "20230109_fahrplaene_gesamtdeutschland_gtfs.zip", "m"
-    )
-    gtfs_de.stops["geometry"] = gp.points_from_xy(
-        gtfs_de.stops.stop_lon, gtfs_de.stops.stop_lat
+    tables = read_tables(FEED_FILE, ["stops", "transfers"])
+    stops = tables["stops"]
+    gdf_stops = gp.GeoDataFrame(
+        stops,
+        geometry=gp.points_from_xy(stops.stop_lon, stops.stop_lat),
+        crs="EPSG:4326",
     )
-    gdf_stops = gp.GeoDataFrame(gtfs_de.stops.copy(), geometry="geometry")
-    gdf_stops.crs = "EPSG:4326"
     gdf_stops.to_crs("EPSG:25832", inplace=True)
 
-    return gtfs_de, gdf_stops
+    return tables["transfers"], gdf_stops
 
 
 def merge_transfers_with_locations(
-    gtfs_de: Feed, gdf_stops: gp.GeoDataFrame
+    df_transfers: pd.DataFrame, gdf_stops: gp.GeoDataFrame
 ) -> pd.DataFrame:
-    """Merge transfers with stop locations."""
-    df_transfers = gtfs_de.transfers.copy()
-    gdf_from = (
-        gdf_stops[["stop_id", "geometry"]]
-        .copy()
-        .rename(columns={"geometry": "from_geometry", "stop_id": "from_stop_id"})
+    """Merge transfers with stop coordinates."""
+    df_locations = pd.DataFrame(
+        {
+            "stop_id": gdf_stops["stop_id"].to_numpy(),
+            "x": gdf_stops.geometry.x.to_numpy(),
+            "y": gdf_stops.geometry.y.to_numpy(),
+        }
     )
-    gdf_to = (
-        gdf_stops[["stop_id", "geometry"]]
-        .copy()
-        .rename(columns={"geometry": "to_geometry", "stop_id": "to_stop_id"})
+    df_from = df_locations.rename(
+        columns={"stop_id": "from_stop_id", "x": "from_x", "y": "from_y"}
     )
-    df_transfers = df_transfers.merge(gdf_from, on="from_stop_id", how="left").merge(
-        gdf_to, on="to_stop_id", how="left"
+    df_to = df_locations.rename(
+        columns={"stop_id": "to_stop_id", "x": "to_x", "y": "to_y"}
+    )
+    df_transfers = df_transfers.merge(df_from, on="from_stop_id", how="left").merge(
+        df_to, on="to_stop_id", how="left"
     )
     return df_transfers
 
 
 def calculate_distance(df_transfers: pd.DataFrame):
     """Get transfers with minimum distance."""
-    df_transfers["distance"] = df_transfers.apply(
-        lambda x: x.from_geometry.distance(x.to_geometry),
-        axis=1,
+    df_transfers["distance"] = np.hypot(
+        df_transfers["from_x"].to_numpy() - df_transfers["to_x"].to_numpy(),
+        df_transfers["from_y"].to_numpy() - df_transfers["to_y"].to_numpy(),
     )
 
 
 def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--max-distance",
+        type=float,
+        default=MAX_TRANSFER_DISTANCE,
+        help="transfers between stops further apart (in metres) are faulty",
+    )
+    args = parser.parse_args()
+
     print("Loading feed...")
-    gtfs_de, gdf_stops = load_feed()
+    df_transfers, gdf_stops = load_feed()
     print("Merging transfers with locations...")
-    df_transfers = merge_transfers_with_locations(gtfs_de, gdf_stops)
+    df_transfers = merge_transfers_with_locations(df_transfers, gdf_stops)
     print("Calculate transfer distances...")
     calculate_distance(df_transfers)
     print("Writing faulty transfers...")
-    df_transfers[df_transfers.distance > 1000][["from_stop_id", "to_stop_id"]].to_csv(
-        "data/faulty_transfers.csv", index=False
-    )
+    df_transfers[df_transfers.distance > args.max_distance][
+        ["from_stop_id", "to_stop_id"]
+    ].to_csv("data/faulty_transfers.csv", index=False)
 
 
 if __name__ == "__main__":
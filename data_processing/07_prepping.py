@@ -1,107 +1,278 @@
 """
 Apply all the pre-processing steps to the data and generate a new GTFS feed.
+
+By default the whole feed is read into memory with gtfs_kit. With --streaming,
+stop_times.txt is filtered chunk by chunk and written straight into the new feed,
+so memory is bounded by the chunk size instead of the feed size.
 """
 
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from io import TextIOWrapper
 from pathlib import Path
+from time import perf_counter
+from typing import IO
+from zipfile import ZipFile, ZIP_DEFLATED
+import shutil
 
 from gtfs_kit.feed import read_feed
 import pandas as pd
 
-print("Reading feed")
-feed = read_feed("data/20230109_fahrplaene_gesamtdeutschland_gtfs.zip", "m")
-
-# Remove faulty transfers
-print("Faulty transfers")
-df_faulty_transfers = pd.read_csv(
-    "data/faulty_transfers.csv",
-    dtype={"from_stop_id": str, "to_stop_id": str},
-)
-
-print("Before:", len(feed.transfers))
-
-for row in df_faulty_transfers.itertuples():
-    feed.transfers.drop(
-        feed.transfers[
-            (feed.transfers.from_stop_id == row.from_stop_id)
-            & (feed.transfers.to_stop_id == row.to_stop_id)
-        ].index,
-        inplace=True,
+from gtfs_io import read_table_chunks, read_tables
+
+
+FEED_FILE = Path("data/20230109_fahrplaene_gesamtdeutschland_gtfs.zip")
+OUT_FILE = Path("data/20230109_preprocessed.zip")
+
+
+@contextmanager
+def step(name: str):
+    """Print the name of a step and how long it took."""
+    print(name)
+    start = perf_counter()
+    yield
+    print(f"{name} took {perf_counter() - start:.1f}s")
+
+
+def remove_faulty_transfers(df_transfers: pd.DataFrame) -> pd.DataFrame:
+    df_faulty_transfers = pd.read_csv(
+        "data/faulty_transfers.csv",
+        dtype={"from_stop_id": str, "to_stop_id": str},
+    )
+
+    print("Before:", len(df_transfers))
+
+    # anti-join on (from_stop_id, to_stop_id)
+    transfer_keys = ["from_stop_id", "to_stop_id"]
+    is_faulty = pd.MultiIndex.from_frame(df_transfers[transfer_keys]).isin(
+        pd.MultiIndex.from_frame(df_faulty_transfers[transfer_keys])
     )
+    df_transfers = df_transfers[~is_faulty]
 
-print("After:", len(feed.transfers))
+    print("After:", len(df_transfers))
+    return df_transfers
 
 
-# Add missing transfers
-print("Missing transfers")
-df_missing_transfers = pd.read_csv(
-    "data/new_transfers.csv",
-    dtype={"from_stop_id": str, "to_stop_id": str},
-)
-df_same_name_transfers = pd.read_csv(
-    "data/new_transfers_same_name.csv",
-    dtype={"from_stop_id": str, "to_stop_id": str},
-)
+def add_missing_transfers(df_transfers: pd.DataFrame) -> pd.DataFrame:
+    df_missing_transfers = pd.read_csv(
+        "data/new_transfers.csv",
+        dtype={"from_stop_id": str, "to_stop_id": str},
+    )
+    df_same_name_transfers = pd.read_csv(
+        "data/new_transfers_same_name.csv",
+        dtype={"from_stop_id": str, "to_stop_id": str},
+    )
 
-print("Before:", len(feed.transfers))
+    print("Before:", len(df_transfers))
 
-df_concat_transfers = pd.concat(
-    [
-        feed.transfers,
-        df_missing_transfers,
-        df_same_name_transfers,
+    df_concat_transfers = pd.concat(
+        [
+            df_transfers,
+            df_missing_transfers,
+            df_same_name_transfers,
+        ]
+    )
+    df_concat_transfers.drop_duplicates(
+        subset=["from_stop_id", "to_stop_id"], inplace=True
+    )
+
+    print("After:", len(df_concat_transfers))
+    return df_concat_transfers
+
+
+def read_blacklist() -> pd.Series:
+    df_blacklist = pd.read_csv(
+        "data/blacklist_ids.txt",
+        names=["stop_id"],
+        header=0,
+        dtype={"stop_id": str},
+    )
+    return df_blacklist.stop_id
+
+
+def blacklist_stops(df_stops: pd.DataFrame, blacklist: pd.Series) -> pd.DataFrame:
+    return df_stops[~df_stops.stop_id.isin(blacklist)]
+
+
+def blacklist_stop_times(
+    df_stop_times: pd.DataFrame, blacklist: pd.Series
+) -> pd.DataFrame:
+    return df_stop_times[~df_stop_times.stop_id.isin(blacklist)]
+
+
+def blacklist_transfers(
+    df_transfers: pd.DataFrame, blacklist: pd.Series
+) -> pd.DataFrame:
+    return df_transfers[
+        ~(
+            df_transfers.from_stop_id.isin(blacklist)
+            | df_transfers.to_stop_id.isin(blacklist)
+        )
     ]
-)
-df_concat_transfers.drop_duplicates(subset=["from_stop_id", "to_stop_id"], inplace=True)
-feed.transfers = df_concat_transfers
-
-print("After:", len(feed.transfers))
-
-
-# Blacklist stops
-print("Blacklist")
-df_blacklist = pd.read_csv(
-    "data/blacklist_ids.txt",
-    names=["stop_id"],
-    header=0,
-    dtype={"stop_id": str},
-)
-
-print("Stops before:", len(feed.stops))
-print("Transfers before:", len(feed.transfers))
-print("Stop times before:", len(feed.trips))
-
-feed.stops.drop(
-    feed.stops[feed.stops.stop_id.isin(df_blacklist.stop_id)].index,
-    inplace=True,
-)
-feed.stop_times.drop(
-    feed.stop_times[feed.stop_times.stop_id.isin(df_blacklist.stop_id)].index,
-    inplace=True,
-)
-feed.transfers.drop(
-    feed.transfers[feed.transfers.from_stop_id.isin(df_blacklist.stop_id)].index,
-    inplace=True,
-)
-feed.transfers.drop(
-    feed.transfers[feed.transfers.to_stop_id.isin(df_blacklist.stop_id)].index,
-    inplace=True,
-)
-
-print("Stops after:", len(feed.stops))
-print("Transfers after:", len(feed.transfers))
-print("Stop times after:", len(feed.trips))
-
-# Renames
-print("Renames")
-df_renames = pd.read_csv("data/rename.csv", dtype={"stop_id": str})
-
-print("Before:", len(feed.stops["stop_name"].unique()))
-
-for row in df_renames.itertuples():
-    feed.stops.loc[feed.stops.stop_id == row.stop_id, ["stop_name"]] = row.new_name
-
-print("After:", len(feed.stops["stop_name"].unique()))
-
-
-# Save feed
-feed.write(Path("data/20230109_preprocessed.zip"))
+
+
+def rename_stops(df_stops: pd.DataFrame) -> pd.DataFrame:
+    df_renames = pd.read_csv("data/rename.csv", dtype={"stop_id": str})
+
+    # report repeated entries, for conflicting ones the last entry wins
+    n_duplicates = df_renames.duplicated(subset=["stop_id", "new_name"]).sum()
+    if n_duplicates > 0:
+        print("Duplicate renames:", n_duplicates)
+
+    renames = df_renames.drop_duplicates(subset=["stop_id"], keep="last").set_index(
+        "stop_id"
+    )["new_name"]
+
+    new_names = df_renames.groupby("stop_id")["new_name"].unique()
+    for stop_id, names in new_names[new_names.str.len() > 1].items():
+        print(
+            f"Conflicting renames for {stop_id}: {list(names)}, "
+            f"using {renames[stop_id]}"
+        )
+
+    print("Before:", len(df_stops["stop_name"].unique()))
+
+    df_stops = df_stops.assign(
+        stop_name=df_stops["stop_id"].map(renames).fillna(df_stops["stop_name"])
+    )
+
+    print("After:", len(df_stops["stop_name"].unique()))
+    return df_stops
+
+
+def prep_in_memory():
+    with step("Reading feed"):
+        feed = read_feed(FEED_FILE, "m")
+
+    with step("Faulty transfers"):
+        feed.transfers = remove_faulty_transfers(feed.transfers)
+
+    with step("Missing transfers"):
+        feed.transfers = add_missing_transfers(feed.transfers)
+
+    with step("Blacklist"):
+        blacklist = read_blacklist()
+
+        print("Stops before:", len(feed.stops))
+        print("Transfers before:", len(feed.transfers))
+        print("Stop times before:", len(feed.stop_times))
+
+        feed.stops = blacklist_stops(feed.stops, blacklist)
+        feed.stop_times = blacklist_stop_times(feed.stop_times, blacklist)
+        feed.transfers = blacklist_transfers(feed.transfers, blacklist)
+
+        print("Stops after:", len(feed.stops))
+        print("Transfers after:", len(feed.transfers))
+        print("Stop times after:", len(feed.stop_times))
+
+    with step("Renames"):
+        feed.stops = rename_stops(feed.stops)
+
+    with step("Writing feed"):
+        feed.write(OUT_FILE)
+
+
+def prep_streaming(chunk_size: int):
+    with step("Reading stops and transfers"):
+        tables = read_tables(FEED_FILE, ["stops", "transfers"])
+        df_stops = tables["stops"]
+        df_transfers = tables["transfers"]
+
+    with step("Faulty transfers"):
+        df_transfers = remove_faulty_transfers(df_transfers)
+
+    with step("Missing transfers"):
+        df_transfers = add_missing_transfers(df_transfers)
+
+    with step("Blacklist"):
+        blacklist = read_blacklist()
+
+        print("Stops before:", len(df_stops))
+        print("Transfers before:", len(df_transfers))
+
+        df_stops = blacklist_stops(df_stops, blacklist)
+        df_transfers = blacklist_transfers(df_transfers, blacklist)
+
+        print("Stops after:", len(df_stops))
+        print("Transfers after:", len(df_transfers))
+
+    with step("Renames"):
+        df_stops = rename_stops(df_stops)
+
+    with step("Writing feed"):
+        write_feed_streaming(df_stops, df_transfers, blacklist, chunk_size)
+
+
+def write_feed_streaming(
+    df_stops: pd.DataFrame,
+    df_transfers: pd.DataFrame,
+    blacklist: pd.Series,
+    chunk_size: int,
+):
+    """
+    Write the new feed table by table: stops and transfers from memory,
+    stop_times filtered chunk by chunk and all other tables copied as they are.
+    """
+    with ZipFile(FEED_FILE) as zf_in:
+        with ZipFile(OUT_FILE, "w", compression=ZIP_DEFLATED) as zf_out:
+            for name in zf_in.namelist():
+                table = Path(name).stem
+                print(f"Writing {name}")
+
+                # stop_times.txt may exceed the zip limit of 2 GiB
+                with zf_out.open(name, "w", force_zip64=True) as f_out:
+                    if table == "stops":
+                        write_csv(df_stops, f_out)
+                    elif table == "transfers":
+                        write_csv(df_transfers, f_out)
+                    elif table == "stop_times":
+                        write_stop_times(f_out, blacklist, chunk_size)
+                    else:
+                        with zf_in.open(name) as f_in:
+                            shutil.copyfileobj(f_in, f_out)
+
+
+def write_csv(df: pd.DataFrame, f_out: IO[bytes]):
+    with TextIOWrapper(f_out, encoding="utf-8", newline="") as f:
+        df.to_csv(f, index=False)
+
+
+def write_stop_times(f_out: IO[bytes], blacklist: pd.Series, chunk_size: int):
+    n_before = 0
+    n_after = 0
+
+    with TextIOWrapper(f_out, encoding="utf-8", newline="") as f:
+        chunks = read_table_chunks(FEED_FILE, "stop_times", chunk_size, raw=True)
+        for i, chunk in enumerate(chunks):
+            n_before += len(chunk)
+            chunk = blacklist_stop_times(chunk, blacklist)
+            n_after += len(chunk)
+            chunk.to_csv(f, header=i == 0, index=False)
+
+    print("Stop times before:", n_before)
+    print("Stop times after:", n_after)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="filter stop_times in chunks instead of loading the whole feed",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1_000_000,
+        help="number of stop_times rows per chunk in streaming mode",
+    )
+    args = parser.parse_args()
+
+    if args.streaming:
+        prep_streaming(args.chunk_size)
+    else:
+        prep_in_memory()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Calculate travel times from all stops to all city centres (Python version of
+08_routing.R, using the array-backed RAPTOR in raptor.py).
+
+Writes one CSV per city centre to data/travel_times_<day>_<time>_arrival in the
+format of tidytransit's travel_times, as expected by 10a_processing.py. The whole
+time window is answered by one profile query per city centre, so it does not need
+to be split into several runs.
+
+The timetable is built once and shared read-only by all worker processes.
+
+Finished targets are recorded in data/routing_<day>_<time>.json together with a
+hash of the inputs (feed, day, time window and limits). A rerun with the same
+inputs only routes targets that are missing or failed. Failed targets are retried
+with half as many workers each time, since failures are mostly memory exhaustion
+at large hubs while other targets are routed in parallel.
+
+Usage: python 08_routing.py [--processes N] [--retries N] [--restart]
+                            {wednesday,saturday,sunday} {day,night}
+"""
+
+from argparse import ArgumentParser
+from datetime import date
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from urllib.parse import quote
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from hashing import file_hash
+from raptor import load_timetable, save_timetable, travel_times_batch
+
+
+DAYS = {
+    "wednesday": date(2023, 5, 24),
+    "saturday": date(2023, 5, 27),
+    "sunday": date(2023, 5, 28),
+}
+
+# earliest departure and latest arrival
+TIMES = {
+    "day": (8 * 3600, 20 * 3600),
+    "night": (20 * 3600, 24 * 3600 - 1),
+}
+
+MAX_TRAVEL_TIME = 60 * 60
+MAX_TRANSFERS = 3
+
+FEED_FILE = Path("data/20230109_preprocessed.zip")
+CITY_FILE = Path("data/Public-Transport-2023-cities.csv")
+
+
+def input_hash(day_name: str, day_time: str) -> str:
+    """Hash of everything the travel times of one day and time depend on."""
+    h = hashlib.sha256()
+    h.update(file_hash(FEED_FILE).encode("ascii"))
+    settings = [str(DAYS[day_name]), *TIMES[day_time], MAX_TRAVEL_TIME, MAX_TRANSFERS]
+    h.update(json.dumps(settings).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_state(state_file: Path, inputs: str) -> dict:
+    """Load the per-target state, or start over if the inputs have changed."""
+    if state_file.exists():
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state["inputs"] == inputs:
+            return state
+        print("Inputs have changed, routing all targets again")
+    return {"inputs": inputs, "targets": {}}
+
+
+def save_state(state_file: Path, state: dict):
+    tmp_file = state_file.with_suffix(".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp_file, state_file)
+
+
+def main():
+    parser = ArgumentParser(description="Calculate travel times to city centres.")
+    parser.add_argument("day", choices=DAYS)
+    parser.add_argument("time", choices=TIMES)
+    parser.add_argument(
+        "--processes", type=int, default=os.cpu_count(), help="worker processes"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=2, help="retries of failed targets"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="route all targets again"
+    )
+    args = parser.parse_args()
+
+    day_name, day_time = args.day, args.time
+    start_time, end_time = TIMES[day_time]
+
+    target_dir = Path(f"data/travel_times_{day_name}_{day_time}_arrival")
+    target_dir.mkdir(exist_ok=True)
+    state_file = Path(f"data/routing_{day_name}_{day_time}.json")
+
+    print("Hashing inputs...")
+    inputs = input_hash(day_name, day_time)
+    state = load_state(state_file, inputs)
+    if args.restart:
+        state["targets"] = {}
+
+    print("Generating stop names...")
+    cities = pd.read_csv(CITY_FILE)
+    unique_stop_names = cities["stop_name"].unique()
+
+    def out_file(stop_name):
+        return target_dir / f"{quote(stop_name, safe='')}.csv"
+
+    todo = [
+        name
+        for name in unique_stop_names
+        if state["targets"].get(name, {}).get("status") != "done"
+        or not out_file(name).exists()
+    ]
+    print(f"{len(unique_stop_names) - len(todo)} targets done, {len(todo)} to route")
+
+    if todo:
+        with TemporaryDirectory(dir="data") as timetable_dir:
+            print("Reading GTFS...")
+            tt = load_timetable(FEED_FILE, DAYS[day_name], start_time, end_time)
+            save_timetable(tt, Path(timetable_dir))
+            del tt
+
+            processes = args.processes
+            for attempt in range(args.retries + 1):
+                if not todo:
+                    break
+                print(f"Running {len(todo)} targets with {processes} processes...")
+                results = travel_times_batch(
+                    Path(timetable_dir),
+                    todo,
+                    start_time,
+                    end_time,
+                    max_transfers=MAX_TRANSFERS,
+                    max_travel_time=MAX_TRAVEL_TIME,
+                    processes=processes,
+                )
+                failed = []
+                for i, (stop_name, df, error) in enumerate(results):
+                    print(f"{i + 1}/{len(todo)} {stop_name}")
+                    target = state["targets"].setdefault(stop_name, {"attempts": 0})
+                    target["attempts"] += 1
+                    if error is None:
+                        df.to_csv(out_file(stop_name))
+                        target.update(status="done", error=None)
+                    else:
+                        # stops missing from the feed fail the same way every time
+                        if not isinstance(error, KeyError):
+                            failed.append(stop_name)
+                        target.update(status="failed", error=str(error))
+                    save_state(state_file, state)
+
+                todo = failed
+                processes = max(1, processes // 2)
+
+    failures = [
+        f"{name} errored: {state['targets'][name]['error']}"
+        for name in unique_stop_names
+        if state["targets"][name]["status"] == "failed"
+    ]
+    pd.Series(failures, dtype="str").to_csv(f"data/fails_{day_name}_{day_time}.csv")
+
+
+if __name__ == "__main__":
+    main()
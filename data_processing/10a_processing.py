@@ -1,9 +1,15 @@
 """
 Read in the CSV files generated by the routing script
 (one for each city centre stop) and generate one file per stop
+
+Input files are parsed in parallel worker processes and their rows are appended
+to the per-stop files from bounded buffers, so the travel times of all city
+centres are never in memory at once.
 """
 
 
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from sys import argv
 from urllib.parse import quote, unquote
@@ -26,25 +32,98 @@ travel_times_dir = Path(f"data/travel_times_{day}_{time}_arrival")
 target_path = Path(f"data/travel_times_{day}_{time}")
 target_path.mkdir(exist_ok=True)
 
-files = list(travel_times_dir.glob("*.csv"))
+files = sorted(travel_times_dir.glob("*.csv"))
 
+# rows kept in memory before they are appended to the per-stop files
+MAX_BUFFERED_ROWS = 1_000_000
 
-def main():
-    dfs = []
+
+def read_rows(file: Path) -> tuple[str, list[str], list[str]]:
+    """
+    Read one routing result and format it as CSV again. Returns the header and,
+    per row, the origin stop name and the CSV line.
+    """
+    df = (
+        pd.read_csv(file, dtype={"to_stop_id": str, "from_stop_id": str})
+        .drop("Unnamed: 0", axis=1, errors="ignore")
+        # rows without an origin stop cannot be assigned to a file
+        .dropna(subset=["from_stop_name"])
+        .drop_duplicates(subset=["from_stop_name"])
+    )
+    header = df.head(0).to_csv(lineterminator="\n")
+    # split on "\n" only, as str.splitlines also splits on "\r", "\x1c", ...
+    lines = [
+        line + "\n"
+        for line in df.to_csv(header=False, lineterminator="\n").split("\n")[:-1]
+    ]
+    if len(lines) != len(df):
+        # a quoted field contains a line break, format the rows one by one
+        lines = [
+            df.iloc[[i]].to_csv(header=False, lineterminator="\n")
+            for i in range(len(df))
+        ]
+    return header, df["from_stop_name"].tolist(), lines
+
+
+def parse_files(executor: ProcessPoolExecutor, max_pending: int):
+    """
+    Parse the input files in order, with at most `max_pending` in flight. Yields
+    the file and the result of read_rows.
+    """
+    pending = deque()
     for file in files:
-        df = (
-            pd.read_csv(file, dtype={"to_stop_id": str, "from_stop_id": str})
-            .drop("Unnamed: 0", axis=1, errors="ignore")
-            .drop_duplicates(subset=["from_stop_name"])
-        )
+        pending.append((file, executor.submit(read_rows, file)))
+        if len(pending) >= max_pending:
+            file, future = pending.popleft()
+            yield file, *future.result()
+    while pending:
+        file, future = pending.popleft()
+        yield file, *future.result()
+
+
+def flush(buffers: dict, header: str):
+    for from_stop_name, lines in buffers.items():
+        file = target_path / f"{quote(from_stop_name, safe='')}.csv"
+        new = not file.exists()
+        with open(file, "a", encoding="utf-8") as f:
+            if new:
+                f.write(header)
+            f.writelines(lines)
+    buffers.clear()
+
+
+def main():
+    # rows are appended, so remove the results of earlier runs
+    for file in target_path.glob("*.csv"):
+        file.unlink()
+
+    buffers = defaultdict(list)
+    buffered_rows = 0
+    header = None
+
+    with ProcessPoolExecutor() as executor:
+        for file, file_header, names, lines in parse_files(
+            executor, 2 * os.cpu_count()
+        ):
+            # the rows of all files are written below the same header
+            if header is None:
+                header = file_header
+            elif file_header != header:
+                raise ValueError(
+                    f"Columns of {file} differ from the other files: "
+                    f"{file_header.strip()} instead of {header.strip()}"
+                )
 
-        dfs.append(df)
+            for from_stop_name, line in zip(names, lines):
+                buffers[from_stop_name].append(line)
+            buffered_rows += len(lines)
 
-    df_all = pd.concat(dfs)
+            if buffered_rows >= MAX_BUFFERED_ROWS:
+                flush(buffers, header)
+                buffered_rows = 0
 
-    for from_stop_name, _df in df_all.groupby("from_stop_name"):
-        stop_name_enc = quote(from_stop_name, safe="")
-        _df.to_csv(target_path / f"{stop_name_enc}.csv", encoding="utf-8")
+    if header is not None:
+        flush(buffers, header)
 
 
 if __name__ == "__main__":
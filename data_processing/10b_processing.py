@@ -1,24 +1,39 @@
 """
 Process the CSV files generated by the routing script.
+
+Writes one JSON file per stop and the same data as a columnar dataset (see
+slot_dataset.py) for 11_merging.py.
+
+Usage: python 10b_processing.py [--executor {process,thread}] DAY TIME
 """
 
 
-from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
 from pathlib import Path
-from sys import argv
 from urllib.parse import quote, unquote
 
-from gtfs_kit.feed import read_feed
-import geopandas as gp
 import pandas as pd
 import ujson as json
 
+from slot_dataset import DatasetWriter, dataset_dir, destinations_json
+from station_index import station_index
 
-day = argv[1]
-time = argv[2]
 
-assert day in ["wednesday", "saturday", "sunday"]
-assert time in ["day", "night"]
+parser = ArgumentParser(description="Process the CSV files of the routing script.")
+parser.add_argument("day", choices=["wednesday", "saturday", "sunday"])
+parser.add_argument("time", choices=["day", "night"])
+parser.add_argument(
+    "--executor",
+    choices=["process", "thread"],
+    default="process",
+    help="parse and encode the stops in processes (default) or threads",
+)
+args = parser.parse_args()
+
+day = args.day
+time = args.time
 
 travel_times_dir = Path(f"data/travel_times_{day}_{time}")
 # travel_times_notrans_dir = Path(f"data/travel_times_{day}_notrans")
@@ -32,43 +47,45 @@ files = list(travel_times_dir.glob("*.csv"))
 station_names = [unquote(f.name[:-4]) for f in files]
 name_for_file = dict(zip(files, station_names))
 
-feed = read_feed("data/20230109_preprocessed.zip", "m")
-
-# Load Bundesland borders
-nw_hi: gp.GeoDataFrame = gp.read_file("data/gemeinden_be_bb_geo.json")
-
-stops_in_nw = feed.get_stops_in_area(nw_hi)
-stop_names_in_nw = set(stops_in_nw["stop_name"].unique())
-
-df_stop_locations = feed.stops.groupby(by=["stop_name"], as_index=False).aggregate(
-    {
-        "stop_lon": "mean",
-        "stop_lat": "mean",
-    }
+# stations by name, built from the feed and the Berlin/Brandenburg borders once and
+# memory-mapped afterwards
+stations = station_index(
+    Path("data/20230109_preprocessed.zip"), Path("data/gemeinden_be_bb_geo.json")
 )
-stop_locations_by_name = {
-    row.stop_name: (row.stop_lat, row.stop_lon)
-    for row in df_stop_locations.itertuples()
-}
-stop_ids_by_name = {row.stop_name: row.stop_id for row in feed.stops.itertuples()}
-stop_locations_by_id = {
-    row.stop_id: (row.stop_lat, row.stop_lon) for row in feed.stops.itertuples()
-}
+stop_names_in_nw = stations.names_in_area()
 
 station_names_in_nw = [n for n in station_names if n in stop_names_in_nw]
 
 available_stops = set(station_names_in_nw)
 
+# columns of the routing results as named in the stop files
+DESTINATION_COLUMNS = {
+    "to_stop_id": "id",
+    "to_stop_name": "name",
+    "travel_time": "time",
+    "transfers": "trans",
+    "to_stop_lat": "lat",
+    "to_stop_lon": "lon",
+}
+
 
 def main():
     dead_stops = set(stop_names_in_nw) - available_stops
-    for stop_name in dead_stops:
-        process_dead_stop(stop_name)
+    dead_stop_infos = [process_dead_stop(stop_name) for stop_name in dead_stops]
     print("Done: ", len(dead_stops))
 
-    executor = ThreadPoolExecutor(max_workers=32)
-    results = executor.map(process_stop, sorted(files))
-    results = list(results)
+    if args.executor == "process":
+        # workers inherit the station index opened above
+        executor = ProcessPoolExecutor(mp_context=get_context("fork"))
+    else:
+        executor = ThreadPoolExecutor(max_workers=32)
+    with executor, DatasetWriter(dataset_dir(day, time)) as dataset:
+        for stop_info in dead_stop_infos:
+            dataset.add(stop_info)
+        for stop_info, destinations in executor.map(
+            process_stop, sorted(files), chunksize=16
+        ):
+            dataset.add(stop_info, destinations)
     print("Done: ", len(available_stops))
 
 
@@ -76,9 +93,9 @@ def process_dead_stop(stop_name):
     print(f"Dead stop: {stop_name}")
 
     stop_info = {
-        "id": stop_ids_by_name[stop_name],
+        "id": stations.stop_id(stop_name),
         "name": stop_name,
-        "coord": stop_locations_by_name[stop_name],
+        "coord": stations.coord(stop_name),
     }
 
     stop_data = {
@@ -92,6 +109,7 @@ def process_dead_stop(stop_name):
         json.dump(stop_data, fp, ensure_ascii=False)
 
     available_stops.add(stop_name)
+    return stop_info
 
 
 def process_stop(file: Path):
@@ -107,29 +125,21 @@ def process_stop(file: Path):
     stop_info = {
         "id": df.iloc[0].from_stop_id,
         "name": stop_name,
-        "coord": stop_locations_by_name[stop_name],
+        "coord": stations.coord(stop_name),
     }
 
     df = df[df["to_stop_name"] != stop_name]
+    destinations = df[list(DESTINATION_COLUMNS)].rename(columns=DESTINATION_COLUMNS)
 
-    destinations = [
-        {
-            "id": row.to_stop_id,
-            "name": row.to_stop_name,
-            "time": row.travel_time,
-            "trans": row.transfers,
-            "coord": [row.to_stop_lat, row.to_stop_lon],
-        }
-        for row in df.itertuples()
-    ]
-
-    stop_data = {
-        "stop_info": stop_info,
-        "destinations": destinations,
-    }
+    stop_data = '{"stop_info":%s,"destinations":%s}' % (
+        json.dumps(stop_info, ensure_ascii=False),
+        destinations_json(destinations),
+    )
 
     with open(target_path / f"{stop_name_enc}.json", "w", encoding="utf-8") as fp:
-        json.dump(stop_data, fp, ensure_ascii=False)
+        fp.write(stop_data)
+
+    return stop_info, destinations
 
 
 if __name__ == "__main__":
@@ -1,15 +1,36 @@
 """
 Merges the data from the three days into one file per stop.
+
+With --columnar, the six day and time slots are read from the datasets written
+by 10b_processing.py (see slot_dataset.py) instead of six files per stop.
+
+The files reference the city centre stations in data/city_centres.json (format
+version 2, see city_centres.py), which is built from the datasets of 10b as well
+and has to be published next to the stop files (see README.md). With --legacy,
+every destination contains the id, name and coordinates of the city centre
+station instead. With --binary, a compact encoding of every file (see
+payload.py) is written next to it.
+
+A summary of all stops (journeys per slot, dead stops) is written to
+data/merged_summary.csv (see stop_summary.py).
 """
 
 
+from argparse import ArgumentParser
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import quote
 import os
 
+import numpy as np
+import pandas as pd
 import ujson as json
 
+from city_centres import FORMAT_VERSION, CityCentres
+from payload import write_payload
+from slot_dataset import dataset_dir, destination_records, read_slot, read_stations
+from stop_summary import COUNT_COLUMNS, summarize, summary_row, write_summary
+
 
 DATA_DIR = Path("data")
 
@@ -23,6 +44,16 @@ dir_monday_night = DATA_DIR / "travel_times_proc_wednesday_night_combine"
 dir_saturday_night = DATA_DIR / "travel_times_proc_saturday_night_combine"
 dir_sunday_night = DATA_DIR / "travel_times_proc_sunday_night_combine"
 
+# labels and (day, time) of 10b in the order the slots are merged
+SLOTS = [
+    ("Werktag", "Tag", "wednesday", "day"),
+    ("Werktag", "Nacht", "wednesday", "night"),
+    ("Samstag", "Tag", "saturday", "day"),
+    ("Samstag", "Nacht", "saturday", "night"),
+    ("Sonntag", "Tag", "sunday", "day"),
+    ("Sonntag", "Nacht", "sunday", "night"),
+]
+
 target_path = DATA_DIR / "merged"
 target_path.mkdir(exist_ok=True)
 
@@ -30,7 +61,7 @@ with open(file_stops, "r", encoding="utf-8") as f:
     stops = json.load(f)
 
 
-def process_stop(stop_name, municipality, lat, lon):
+def process_stop(stop_name, municipality, lat, lon, centres=None, binary=False):
     print(".", end="", flush=True)
     stop_name_enc = quote(stop_name, safe="")
     _filename = f"{stop_name_enc}.json"
@@ -71,18 +102,202 @@ def process_stop(stop_name, municipality, lat, lon):
         "stopInfo": stop_info,
         "travelTimes": travel_times,
     }
+    summary = summarize(stop_name_enc, merged)
+
+    if binary:
+        write_payload(merged, target_path / f"{stop_name_enc}.bin")
+
+    if centres is not None:
+        for times in travel_times.values():
+            for label_time, destinations in times.items():
+                times[label_time] = [centres.encode(d) for d in destinations]
+        merged = {"version": FORMAT_VERSION, **merged}
 
     with open(target_path / f"{stop_name_enc}.json", "w", encoding="utf-8") as f:
         json.dump(merged, f, ensure_ascii=False)
 
+    return summary
+
+
+def check_datasets(reason: str):
+    missing = [
+        str(dataset_dir(day, time))
+        for _, _, day, time in SLOTS
+        if not (dataset_dir(day, time) / "destinations.parquet").exists()
+    ]
+    if missing:
+        raise FileNotFoundError(
+            f"Missing datasets of 10b_processing.py ({reason}), "
+            f"run it first: {', '.join(missing)}"
+        )
+
+
+def merge_files(legacy: bool, binary: bool):
+    centres = None
+    if not legacy:
+        check_datasets("needed for the city centres, or use --legacy")
+        stop_names = sorted({stop[0] for stop in stops})
+        centres = CityCentres.from_frame(
+            pd.concat(read_stations(day, time, stop_names) for _, _, day, time in SLOTS)
+        )
+        centres.save()
+
+    executor = ThreadPoolExecutor(max_workers=32)
+    futs = []
+    for stop_name, municipality, lat, lon in stops:
+        futs.append(
+            executor.submit(
+                process_stop, stop_name, municipality, lat, lon, centres, binary
+            )
+        )
+
+    write_summary([fut.result() for fut in futs], target_path)
+
+    executor.shutdown(wait=True)
+
+
+def destinations_by_stop(destinations, centres=None) -> dict[str, str]:
+    """The destinations of each origin stop as a JSON array."""
+    destinations = destinations.sort_values("from_stop_name", kind="stable")
+    if centres is None:
+        records = destination_records(destinations)
+    else:
+        records = centres.records(destinations)
+    names = destinations["from_stop_name"].to_numpy()
+    if len(names) == 0:
+        return {}
+
+    starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+    ends = np.r_[starts[1:], len(names)]
+    return {
+        names[start]: "[" + ",".join(records[start:end]) + "]"
+        for start, end in zip(starts, ends)
+    }
+
+
+def merge_columnar(legacy: bool, binary: bool):
+    check_datasets("needed for --columnar")
+    stop_names = sorted({stop[0] for stop in stops})
+
+    stop_infos = {}
+    slots = []
+    for label_day, label_time, day, time in SLOTS:
+        print(f"Reading {day} {time}...")
+        slot_stops, destinations = read_slot(day, time, stop_names)
+        for row in slot_stops.itertuples():
+            if row.name not in stop_infos:
+                stop_infos[row.name] = {
+                    "id": row.id,
+                    "name": row.name,
+                    "coord": [float(row.lat), float(row.lon)],
+                }
+        slots.append(destinations)
+
+    centres = None
+    if not legacy:
+        centres = CityCentres.from_frame(
+            pd.concat(slot[["id", "name", "lat", "lon"]] for slot in slots)
+        )
+        centres.save()
+
+    counts = pd.DataFrame(
+        {
+            column: slot.groupby("from_stop_name").size()
+            for column, slot in zip(COUNT_COLUMNS, slots)
+        },
+        index=stop_names,
+    )
+    counts = counts.fillna(0).astype("int64")
+    minima = (
+        pd.concat(slot[["from_stop_name", "time", "trans"]] for slot in slots)
+        .groupby("from_stop_name")
+        .min()
+    )
+
+    slot_destinations = [destinations_by_stop(slot, centres) for slot in slots]
+    del slots
+
+    print(f"Writing {len(stops)} stops...")
+    summary = []
+    for stop_name, municipality, lat, lon in stops:
+        stop_info = stop_infos.get(stop_name)
+        if stop_info is None:
+            stop_info = {
+                "name": stop_name,
+                "municipality": municipality,
+                "coord": [lat, lon],
+            }
+        else:
+            stop_info = {**stop_info, "municipality": municipality}
+
+        travel_times = {}
+        for (label_day, label_time, _, _), destinations in zip(
+            SLOTS, slot_destinations
+        ):
+            travel_times.setdefault(label_day, []).append(
+                f'"{label_time}":{destinations.get(stop_name, "[]")}'
+            )
+
+        merged = '{%s"stopInfo":%s,"travelTimes":{%s}}' % (
+            "" if legacy else f'"version":{FORMAT_VERSION},',
+            json.dumps(stop_info, ensure_ascii=False),
+            ",".join(
+                f'"{label_day}":{{{",".join(times)}}}'
+                for label_day, times in travel_times.items()
+            ),
+        )
+
+        stop_name_enc = quote(stop_name, safe="")
+        with open(target_path / f"{stop_name_enc}.json", "w", encoding="utf-8") as f:
+            f.write(merged)
+
+        if stop_name in minima.index:
+            min_time, min_trans = minima.loc[stop_name].tolist()
+        else:
+            min_time, min_trans = None, None
+        summary.append(
+            summary_row(
+                stop_name_enc,
+                stop_info,
+                counts.loc[stop_name].tolist(),
+                min_time,
+                min_trans,
+            )
+        )
+
+        if binary:
+            data = json.loads(merged)
+            if centres is not None:
+                data = centres.decode_stop(data)
+            write_payload(data, target_path / f"{stop_name_enc}.bin")
+
+    write_summary(summary, target_path)
+
 
-executor = ThreadPoolExecutor(max_workers=32)
-futs = []
-for stop_name, municipality, lat, lon in stops:
-    futs.append(executor.submit(process_stop, stop_name, municipality, lat, lon))
+def main():
+    parser = ArgumentParser(description="Merge the day and time slots per stop.")
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="read the columnar datasets of 10b instead of the per-stop files",
+    )
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="write full destinations instead of references to the city centres",
+    )
+    parser.add_argument(
+        "--binary",
+        action="store_true",
+        help="also write the compact binary encoding of every file",
+    )
+    args = parser.parse_args()
 
+    if args.columnar:
+        merge_columnar(args.legacy, args.binary)
+    else:
+        merge_files(args.legacy, args.binary)
 
-for fut in futs:
-    fut.result()
 
-executor.shutdown(wait=True)
+if __name__ == "__main__":
+    main()
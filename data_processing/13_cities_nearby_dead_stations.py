@@ -1,53 +1,58 @@
 """
 For each dead station, find city centre stops that are nearby
+
+The nearest city centre stops of all dead stations are written to a single table,
+one row per dead station and rank, with the file name of the dead station's stop
+file (see stop_summary.py) and the great-circle distance in metres.
 """
 
-import os
 import pandas as pd
 import numpy as np
-from geopy import distance
+from scipy.spatial import cKDTree
 from urllib.parse import quote
 
 DEAD_STATIONS_FILE = "data/dead_stations.csv"
 CITY_FILE = "data/Public-Transport-2023-cities.csv"
 
-OUT_DIR = "data/cities_nearby_dead_stations"
-os.makedirs(OUT_DIR, exist_ok=True)
+OUT = "data/cities_nearby_dead_stations.csv"
+
+# 14_vbb.py requests journeys to the 5 nearest city centres, 15_google_maps.py
+# to the nearest one
+N_NEAREST = 5
+
+EARTH_RADIUS = 6_371_008.8  # m, mean radius
+
+
+def unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
 
 
 def main():
-    df = pd.read_csv(DEAD_STATIONS_FILE).set_index("stop_name")
-    dead_stations = [
-        {"stop_name": index, "coords": (row["lat"], row["lon"])}
-        for index, row in df.iterrows()
-    ]
-
-    df_city = pd.read_csv(CITY_FILE).set_index("stop_name")
-    city_stations = [
-        {"stop_name": index, "coords": (row["stop_lat"], row["stop_lon"])}
-        for index, row in df_city.iterrows()
-    ]
-
-    # compute distances between all city main stations and given stops
-    distances = np.zeros([len(dead_stations), len(city_stations)])
-    for i, dead_station in enumerate(dead_stations):
-        for j, city_station in enumerate(city_stations):
-            distances[i, j] = distance.distance(
-                dead_station["coords"], city_station["coords"]
-            ).meters
-        print(i + 1, "/", len(dead_stations))
-
-    for dead_station_id in range(len(dead_stations)):
-        dead_station = dead_stations[dead_station_id]
-        dist_to_dead = distances[dead_station_id]
-
-        df_nearby = df_city.copy(deep=True)
-        df_nearby["distance"] = dist_to_dead
-        df_nearby = df_nearby.sort_values(by="distance")
-
-        df_nearby.to_csv(
-            OUT_DIR + "/" + quote(dead_station["stop_name"], safe="") + ".csv"
-        )
+    df = pd.read_csv(DEAD_STATIONS_FILE)
+    df_city = pd.read_csv(CITY_FILE)
+
+    # nearest neighbours by chord length between points on the unit sphere are
+    # the nearest by great-circle distance
+    tree = cKDTree(unit_vectors(df_city["stop_lat"], df_city["stop_lon"]))
+    k = min(N_NEAREST, len(df_city))
+    chords, idx = tree.query(
+        unit_vectors(df["lat"], df["lon"]), k=list(range(1, k + 1))
+    )
+
+    files = [quote(stop_name, safe="") for stop_name in df["stop_name"]]
+    df_nearby = df_city.iloc[idx.ravel()].reset_index(drop=True)
+    df_nearby.insert(0, "file", np.repeat(files, k))
+    df_nearby.insert(1, "dead_stop_name", np.repeat(df["stop_name"].to_numpy(), k))
+    df_nearby.insert(2, "rank", np.tile(np.arange(k), len(df)))
+    df_nearby["distance"] = 2 * EARTH_RADIUS * np.arcsin(chords.ravel() / 2)
+
+    df_nearby.to_csv(OUT, index=False)
+
+    print("# dead stations", len(df), "with", k, "nearby city centres each")
 
 
 if __name__ == "__main__":
@@ -1,62 +1,78 @@
 """
 Find journeys for dead stop to city centres using data from https://www.vbb.de/
+
+Dead stops are looked up in the summary of data/merged (see stop_summary.py).
+Only the files of stops that journeys are added to are written to the target
+directory, and its summary (covering all stops) is written for 15_google_maps.py.
+
+With --all-slots, the journeys of all six day and time slots are requested in one
+pass, instead of one run per slot. Journeys to a city centre that a stop already
+has in a slot (from an earlier run) are not requested again.
+
+The journeys of several dead stops are requested concurrently, at the API's rate
+limit (see vbb_client.py). Each stop's file is written as soon as its requests are
+done. Responses are cached across runs (see request_cache.py).
 """
 
-import os
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-from urllib.parse import quote
 import re
-import requests
 from datetime import datetime
 import json
-from time import sleep
 from pathlib import Path
 import sys
-import glob
 
-IN_DIR = "data/merged"
-DATA_DIR = "data/cities_nearby_dead_stations"
+from city_centres import load_city_centres
+from journey_slots import add_journey, add_slot_arguments, has_journey, parse_slots
+from request_cache import RequestCache
+from stop_summary import read_summary, stop_file, stop_row, summarize, write_summary
+from vbb_client import REQUESTS_PER_MINUTE, VBB_URL, VBBClient
 
-VBB_ENDPOINT = "https://v5.vbb.transport.rest/journeys"
+IN_DIR = "data/merged"
+NEARBY_FILE = "data/cities_nearby_dead_stations.csv"
 
 target_dir = Path("data/with_vbb_data")
 target_dir.mkdir(exist_ok=True)
 
-requested_ids = {}
-
-
-def usage():
-    print(
-        f"Usage: python {sys.argv[0]} " + "{wednesday,saturday,sunday} {day,night}",
-        file=sys.stderr,
-    )
-
-
-if len(sys.argv) < 3:
-    print("Arguments missing", end="\n\n", file=sys.stderr)
-    usage()
-    sys.exit(1)
-
-given_day = sys.argv[1]
-given_time = sys.argv[2]
+# city centres referenced by files of format version 2
+centres = load_city_centres([target_dir, IN_DIR])
 
-assert given_day in ["wednesday", "saturday", "sunday"]
-assert given_time in ["day", "night"]
-
-if given_day == "wednesday":
-    day = {"name": "Werktag", "date": "2023-02-08"}
-elif given_day == "saturday":
-    day = {"name": "Samstag", "date": "2023-02-04"}
-else:
-    day = {"name": "Sonntag", "date": "2023-02-12"}
+requested_ids = {}
 
-if given_time == "day":
-    time = {"name": "Tag", "start": "08:00:00", "end": "20:00:00"}
-else:
-    time = {"name": "Nacht", "start": "20:00:00", "end": "23:59:59"}
+parser = ArgumentParser(description="Find journeys for dead stops with the VBB API.")
+add_slot_arguments(parser)
+parser.add_argument(
+    "--base-url",
+    default=VBB_URL,
+    help=f"URL of the VBB API, e.g. of a local stub (default: {VBB_URL})",
+)
+parser.add_argument(
+    "--requests-per-minute",
+    type=float,
+    default=REQUESTS_PER_MINUTE,
+    help=f"request rate (default: {REQUESTS_PER_MINUTE})",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=8,
+    help="number of dead stops requested concurrently (default: 8)",
+)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="neither use nor store cached responses",
+)
+args = parser.parse_args()
+
+slots = parse_slots(parser, args)
 
 
 def get_vbb_id(stop_id):
+    # stops that none of the routing results start from have no id
+    if stop_id is None:
+        return None
     if not stop_id.startswith("de"):
         return stop_id
     else:
@@ -66,24 +82,20 @@ def get_vbb_id(stop_id):
     return None
 
 
-def find_valid_stop_id(stop_id, stop_name):
+def find_valid_stop_id(client, stop_id, stop_name):
     if stop_name in requested_ids:
         return requested_ids[stop_name]
 
     # request stop with the given id
-    sleep(1)
-    response = requests.get(
-        f"https://v5.vbb.transport.rest/stops/{stop_id}",
-    )
+    response = client.get(f"/stops/{stop_id}")
 
     # if there is a response, the given stop id should be valid
     if response.ok:
         return stop_id
 
     # if not, query VBBs database using the stop name
-    sleep(1)
-    response = requests.get(
-        "https://v5.vbb.transport.rest/stations",
+    response = client.get(
+        "/stations",
         params={
             "query": stop_name,
         },
@@ -108,196 +120,223 @@ def find_valid_stop_id(stop_id, stop_name):
     return None
 
 
-def main():
-    files = glob.glob(IN_DIR + "/*.json")
-    n_files = len(files)
-
-    # this script is run multiple times, so we add to the target directory
-    # instead of overwriting it
-    result_files = list(target_dir.glob("*.json"))
-
-    request_counter = 0
-    for index, filename in enumerate(files):
-        # if a file fot the given stop exists within the target directory, use that one
-        basename = os.path.basename(filename)
-        if target_dir / basename in result_files:
-            fn = target_dir / basename
-        else:
-            fn = filename
-
-        # read data
-        with open(fn, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        station_id = data["stopInfo"]["id"]
-        station_name = data["stopInfo"]["name"]
-        stop_name_enc = quote(station_name, safe="")
+def request_journeys(client, from_id, to_id, departure):
+    return client.get(
+        "/journeys",
+        params={
+            "from": from_id,
+            "to": to_id,
+            "departure": int(departure),
+            "results": 1,
+            "transfers": 3,
+            "startWithWalking": False,
+            "subStops": False,
+            "entrances": False,
+            "remarks": False,
+        },
+    )
 
-        # get file with nearby stations for that stop
-        filename_nearby = DATA_DIR + "/" + stop_name_enc + ".csv"
 
-        # if there is no file with nearby stations, the stop is not dead,
-        # write data to the target directory and continue
-        if not os.path.exists(filename_nearby):
-            with open(target_dir / f"{stop_name_enc}.json", "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False)
-            continue
+def process_stop(client, data, df_nearby):
+    """
+    Add the journeys from a dead stop to its nearby city centres in every slot
+    to its data. Returns the number of journeys added, or None if the stop has
+    no VBB id.
+    """
+    station_id = data["stopInfo"].get("id")
 
-        # get city centre stations closest to the current stop
-        df_nearby = pd.read_csv(filename_nearby).sort_values(by="distance").iloc[:5]
-        df_nearby["vbb_id"] = df_nearby["stop_id"].apply(get_vbb_id)
-
-        if df_nearby["vbb_id"].isnull().sum() > 0:
-            print(df_nearby[["stop_id", "vbb_id"]])
-
-        # once 90 requests have been sent, sleep for a minute and reset the counter
-        # (the limit is 100 requests per minute)
-        if request_counter > 90:
-            print("sleeping...", file=sys.stderr)
-            sleep(60)
-            request_counter = 0
-
-        dead_stop_id = get_vbb_id(station_id)
-        if dead_stop_id is None:
-            print("No VBB id could be extracted", station_id)
-            continue
+    df_nearby = df_nearby.copy()
+    df_nearby["vbb_id"] = df_nearby["stop_id"].apply(get_vbb_id)
+
+    if df_nearby["vbb_id"].isnull().sum() > 0:
+        print(df_nearby[["stop_id", "vbb_id"]])
+
+    dead_stop_id = get_vbb_id(station_id)
+    if dead_stop_id is None:
+        print("No VBB id could be extracted", station_id)
+        return None
 
+    n_added = 0
+    for day, time in slots:
         departure = datetime.fromisoformat(
             day["date"] + "T" + time["start"] + "+01:00"
         ).timestamp()
+        n_slot, dead_stop_id = request_slot(
+            client, data, df_nearby, dead_stop_id, day, time, departure
+        )
+        n_added += n_slot
+    return n_added
+
+
+def request_slot(client, data, df_nearby, dead_stop_id, day, time, departure):
+    """
+    Add the journeys of a slot. Returns their number and the VBB id of the dead
+    stop, which is looked up by name if the given one is not found.
+    """
+    station_name = data["stopInfo"]["name"]
+
+    n_added = 0
+    # request journeys from the current stop to close city centres
+    for city_row in df_nearby.itertuples():
+        if has_journey(data, day, time, city_row, centres):
+            continue
+
+        try:
+            city_id = city_row.vbb_id
+
+            print(station_name, "->", city_row.stop_name)
 
-        # request journeys from the current stop to close city centres
-        for city_row in df_nearby.itertuples():
-            try:
-                city_id = city_row.vbb_id
-
-                print()
-                print(index + 1, "/", n_files, file=sys.stderr)
-                print(index + 1, "/", n_files, station_name, "->", city_row.stop_name)
-
-                # request journeys
-                sleep(1)
-                response = requests.get(
-                    VBB_ENDPOINT,
-                    params={
-                        "from": dead_stop_id,
-                        "to": city_id,
-                        "departure": int(departure),
-                        "results": 1,
-                        "transfers": 3,
-                        "startWithWalking": False,
-                        "subStops": False,
-                        "entrances": False,
-                        "remarks": False,
-                    },
+            # request journeys
+            response = request_journeys(client, dead_stop_id, city_id, departure)
+            d = response.json()
+
+            if not response.ok:
+                print(
+                    "Response not ok",
+                    response.url,
+                    response.status_code,
+                    d["message"],
                 )
-                request_counter += 1
-                d = response.json()
-
-                if not response.ok:
-                    print(
-                        "Response not ok",
-                        response.url,
-                        response.status_code,
-                        d["message"],
+
+                # attempt to request valid stop ids
+                # if the given stop ids weren't found
+                if d["message"] == "location/stop not found":
+                    dead_stop_id = find_valid_stop_id(
+                        client, dead_stop_id, station_name
                     )
+                    city_id = find_valid_stop_id(client, city_id, city_row.stop_name)
 
-                    # attempt to request valid stop ids
-                    # if the given stop ids weren't found
-                    if d["message"] == "location/stop not found":
-                        dead_stop_id = find_valid_stop_id(dead_stop_id, station_name)
-                        city_id = find_valid_stop_id(city_id, city_row.stop_name)
-                        request_counter += 4
-
-                        if dead_stop_id is None:
-                            print("Could not find stop id", station_name)
-                            continue
-                        if city_id is None:
-                            print("Could not find stop id", city_row.stop_name)
-                            continue
-
-                        # retry computing journeys with updated stop ids
-                        print("Retry...")
-                        sleep(1)
-                        response = requests.get(
-                            VBB_ENDPOINT,
-                            params={
-                                "from": dead_stop_id,
-                                "to": city_id,
-                                "departure": int(departure),
-                                "results": 1,
-                                "transfers": 3,
-                                "startWithWalking": False,
-                                "subStops": False,
-                                "entrances": False,
-                                "remarks": False,
-                            },
-                        )
-                        request_counter += 1
-                        d = response.json()
-                        print(response.url)
-
-                        if not response.ok:
-                            print(
-                                "Response not ok",
-                                response.url,
-                                response.status_code,
-                                d["message"],
-                            )
-                            continue
-                    else:
+                    if dead_stop_id is None:
+                        print("Could not find stop id", station_name)
+                        continue
+                    if city_id is None:
+                        print("Could not find stop id", city_row.stop_name)
                         continue
 
-                if len(d["journeys"]) == 0:
-                    print("No journeys found", response.url)
+                    # retry computing journeys with updated stop ids
+                    print("Retry...")
+                    response = request_journeys(
+                        client, dead_stop_id, city_id, departure
+                    )
+                    d = response.json()
+                    print(response.url)
+
+                    if not response.ok:
+                        print(
+                            "Response not ok",
+                            response.url,
+                            response.status_code,
+                            d["message"],
+                        )
+                        continue
+                else:
                     continue
 
-                legs = d["journeys"][0]["legs"]
+            if len(d["journeys"]) == 0:
+                print("No journeys found", response.url)
+                continue
 
-                if len(legs) == 0:
-                    print("No legs", response.url)
-                    continue
+            legs = d["journeys"][0]["legs"]
 
-                start_time = datetime.fromisoformat(legs[0]["plannedDeparture"])
-                end_time = datetime.fromisoformat(legs[-1]["plannedArrival"])
+            if len(legs) == 0:
+                print("No legs", response.url)
+                continue
 
-                d1 = datetime.fromisoformat(f"{day['date']}T{time['start']}+01:00")
-                d2 = datetime.fromisoformat(f"{day['date']}T{time['end']}+01:00")
+            start_time = datetime.fromisoformat(legs[0]["plannedDeparture"])
+            end_time = datetime.fromisoformat(legs[-1]["plannedArrival"])
 
-                # check if start time is within given time range
-                if start_time < d1 or start_time > d2:
-                    print("Start time not in given range", start_time, response.url)
-                    continue
+            d1 = datetime.fromisoformat(f"{day['date']}T{time['start']}+01:00")
+            d2 = datetime.fromisoformat(f"{day['date']}T{time['end']}+01:00")
 
-                # check if the destination was reached within an hour
-                duration = (end_time - start_time).total_seconds()
-                if duration > 60 * 60:
-                    print("Duration", end_time - start_time, response.url)
-                    continue
+            # check if start time is within given time range
+            if start_time < d1 or start_time > d2:
+                print("Start time not in given range", start_time, response.url)
+                continue
 
-                # exclude walking legs to find the correct number of transitions
-                legs_without_walking = [
-                    l for l in legs if not ("walking" in l and l["walking"])
-                ]
+            # check if the destination was reached within an hour
+            duration = (end_time - start_time).total_seconds()
+            if duration > 60 * 60:
+                print("Duration", end_time - start_time, response.url)
+                continue
 
-                if len(legs_without_walking) == 0:
-                    print("No non-walking legs", response.url)
-                    continue
+            # exclude walking legs to find the correct number of transitions
+            legs_without_walking = [
+                l for l in legs if not ("walking" in l and l["walking"])
+            ]
 
-                data["travelTimes"][day["name"]][time["name"]].append(
-                    {
-                        "id": city_row.stop_id,
-                        "name": city_row.stop_name,
-                        "time": duration,
-                        "trans": len(legs_without_walking) - 1,
-                        "coords": [city_row.stop_lat, city_row.stop_lon],
-                    }
-                )
+            if len(legs_without_walking) == 0:
+                print("No non-walking legs", response.url)
+                continue
+
+            add_journey(
+                data,
+                day,
+                time,
+                {
+                    "id": city_row.stop_id,
+                    "name": city_row.stop_name,
+                    "time": duration,
+                    "trans": len(legs_without_walking) - 1,
+                    "coords": [city_row.stop_lat, city_row.stop_lon],
+                },
+                centres,
+            )
+            n_added += 1
+
+        except Exception as e:
+            print("Unknown error", str(e))
+
+    return n_added, dead_stop_id
+
+
+def main():
+    stops = read_summary(IN_DIR)
+    # nearby city centre stops of the dead stops by file name, nearest first
+    nearby = dict(
+        tuple(pd.read_csv(NEARBY_FILE, dtype={"file": "string"}).groupby("file"))
+    )
+    summary = []
+
+    cache = None if args.no_cache else RequestCache()
+    client = VBBClient(args.base_url, args.requests_per_minute, cache=cache)
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    futures = {}
+
+    for stop_name_enc in stops.index:
+        # if the stop is not dead or there are no nearby city centres, its file in
+        # the input directory stays current (a file left in the target directory
+        # by an earlier run would hide it)
+        if not stops.loc[stop_name_enc, "dead"] or stop_name_enc not in nearby:
+            (target_dir / f"{stop_name_enc}.json").unlink(missing_ok=True)
+            summary.append(stop_row(stops, stop_name_enc))
+            continue
+
+        # read data, including the journeys added by earlier runs
+        fn = stop_file(stop_name_enc, [target_dir, IN_DIR])
+        with open(fn, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        # get city centre stations closest to the current stop
+        df_nearby = nearby[stop_name_enc].sort_values(by="distance").iloc[:5]
+
+        future = executor.submit(process_stop, client, data, df_nearby)
+        futures[future] = (stop_name_enc, data)
+
+    for index, future in enumerate(as_completed(futures)):
+        stop_name_enc, data = futures[future]
+        n_added = future.result()
+        print(index + 1, "/", len(futures), file=sys.stderr)
+
+        if n_added:
+            with open(target_dir / f"{stop_name_enc}.json", "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+        summary.append(summarize(stop_name_enc, data))
 
-            except Exception as e:
-                print("Unknown error", str(e))
+    executor.shutdown(wait=True)
+    write_summary(summary, target_dir)
 
-        with open(target_dir / f"{stop_name_enc}.json", "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False)
+    if cache is not None:
+        cache.report()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,48 @@
 """
 Merge all result files into a single file.
+
+Files of format version 2 are expanded, so every journey contains the city centre
+station's id, name and coordinates. With --binary, the compact encoding of every
+stop (see payload.py) is written to data/with_google_maps_data_bin as well.
+
+14_vbb.py and 15_google_maps.py only write the files of stops they add journeys
+to, so every stop's file is taken from the first of IN_DIRS that has it.
 """
 
+from pathlib import Path
 import json
-import glob
+import sys
 
-IN_DIR = "data/with_google_maps_data"
+from city_centres import is_encoded, load_city_centres
+from payload import write_payload
+from stop_summary import read_summary, stop_file
+
+IN_DIRS = ["data/with_google_maps_data", "data/with_vbb_data", "data/merged"]
 OUT = "data/with_google_maps_data.json"
+BINARY_DIR = Path("data/with_google_maps_data_bin")
 
 
 def main():
-    files = glob.glob(IN_DIR + "/*.json")
+    # every stop has a file in data/merged, listed in its summary
+    files = [stop_file(file, IN_DIRS) for file in read_summary(IN_DIRS[-1]).index]
+
+    binary = "--binary" in sys.argv[1:]
+    if binary:
+        BINARY_DIR.mkdir(exist_ok=True)
+
+    centres = load_city_centres(IN_DIRS)
 
     data = []
     for filename in files:
         with open(filename, "r", encoding="utf-8") as f:
-            data.append(json.load(f))
+            content = json.load(f)
+
+        if is_encoded(content):
+            content = centres.decode_stop(content)
+        data.append(content)
+
+        if binary:
+            write_payload(content, BINARY_DIR / f"{Path(filename).stem}.bin")
 
     with open(OUT, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False)
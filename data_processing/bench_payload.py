@@ -0,0 +1,83 @@
+"""
+Benchmark the compact binary stop payload of payload.py against the JSON stop
+files (the full format and, if the files use it, format version 2): size (raw and
+gzip-compressed, as served) and decoding time to the full format in Python.
+
+Usage: python bench_payload.py [directory with stop JSON files, default data/merged]
+"""
+
+from pathlib import Path
+from time import perf_counter
+import gzip
+import sys
+
+import ujson as json
+
+from city_centres import CITY_CENTRES_FILE, CityCentres, is_encoded
+from payload import COORD_SCALE, decode_stop, encode_stop
+
+
+def same(a: dict, b: dict) -> bool:
+    """Compare journeys up to the quantisation of coordinates and times."""
+    coord = a["coord"] if "coord" in a else a["coords"]
+    return (
+        (a["id"], a["name"], a["trans"]) == (b["id"], b["name"], b["trans"])
+        and round(a["time"]) == b["time"]
+        and abs(coord[0] - b["coord"][0]) <= 0.5 / COORD_SCALE
+        and abs(coord[1] - b["coord"][1]) <= 0.5 / COORD_SCALE
+    )
+
+
+def main():
+    directory = Path(sys.argv[1] if len(sys.argv) > 1 else "data/merged")
+    files = sorted(directory.glob("*.json"))
+    centres = CityCentres.load() if CITY_CENTRES_FILE.exists() else None
+
+    print(f"Encoding {len(files)} stops...")
+    texts = [file.read_bytes() for file in files]
+    stops = [json.loads(text) for text in texts]
+    stops = [centres.decode_stop(s) if is_encoded(s) else s for s in stops]
+    legacy = [json.dumps(s, ensure_ascii=False).encode("utf-8") for s in stops]
+    payloads = [encode_stop(s) for s in stops]
+
+    def decode_v2(text):
+        data = json.loads(text)
+        return centres.decode_stop(data) if is_encoded(data) else data
+
+    formats = [("json", json.loads, legacy)]
+    if centres is not None:
+        formats.append(("json v2", decode_v2, texts))
+    formats.append(("binary", decode_stop, payloads))
+
+    durations = {}
+    for name, decode, blobs in formats:
+        size = sum(len(b) for b in blobs)
+        size_gzip = sum(len(gzip.compress(b)) for b in blobs)
+
+        start = perf_counter()
+        for blob in blobs:
+            decode(blob)
+        durations[name] = perf_counter() - start
+
+        print(
+            f"{name:<8} {size / 1e6:>8.2f} MB {size_gzip / 1e6:>8.2f} MB gzip"
+            f" {durations[name] * 1e3 / len(blobs):>8.3f} ms per stop"
+        )
+
+    for stop, payload in zip(stops, payloads):
+        decoded = decode_stop(payload)
+        for label_day, times in stop["travelTimes"].items():
+            for label_time, destinations in times.items():
+                other = decoded["travelTimes"][label_day][label_time]
+                assert len(destinations) == len(other), "results differ"
+                assert all(map(same, destinations, other)), "results differ"
+
+    size_ratio = sum(map(len, legacy)) / sum(map(len, payloads))
+    print(f"size: {size_ratio:.1f}x smaller than json")
+    for name, _, _ in formats[:-1]:
+        speedup = durations[name] / durations["binary"]
+        print(f"decoding: {speedup:.1f}x faster than {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark the vectorized transfer distance of 06_teleporting.py against the
+previous row-wise shapely `apply` on the DELFI transfers table.
+
+Usage: python bench_teleporting.py [number of transfers to sample]
+"""
+
+from importlib import import_module
+from time import perf_counter
+import sys
+
+import geopandas as gp
+import numpy as np
+import pandas as pd
+
+teleporting = import_module("06_teleporting")
+
+
+def legacy(df_transfers: pd.DataFrame, gdf_stops: gp.GeoDataFrame) -> pd.Series:
+    """Geometry merges and row-wise distance as it was before."""
+    gdf_from = gdf_stops[["stop_id", "geometry"]].rename(
+        columns={"geometry": "from_geometry", "stop_id": "from_stop_id"}
+    )
+    gdf_to = gdf_stops[["stop_id", "geometry"]].rename(
+        columns={"geometry": "to_geometry", "stop_id": "to_stop_id"}
+    )
+    df = df_transfers.merge(gdf_from, on="from_stop_id", how="left").merge(
+        gdf_to, on="to_stop_id", how="left"
+    )
+    return df.apply(lambda x: x.from_geometry.distance(x.to_geometry), axis=1)
+
+
+def vectorized(df_transfers: pd.DataFrame, gdf_stops: gp.GeoDataFrame) -> pd.Series:
+    df = teleporting.merge_transfers_with_locations(df_transfers, gdf_stops)
+    teleporting.calculate_distance(df)
+    return df["distance"]
+
+
+def main():
+    print("Loading feed...")
+    df_transfers, gdf_stops = teleporting.load_feed()
+
+    # transfers between unknown stops have no geometry to measure
+    df_transfers = df_transfers[
+        df_transfers.from_stop_id.isin(gdf_stops.stop_id)
+        & df_transfers.to_stop_id.isin(gdf_stops.stop_id)
+    ]
+    if len(sys.argv) > 1:
+        df_transfers = df_transfers.sample(int(sys.argv[1]), random_state=42)
+
+    print(f"{len(df_transfers)} transfers")
+
+    results = {}
+    durations = {}
+    for name, fn in [("apply", legacy), ("vectorized", vectorized)]:
+        start = perf_counter()
+        results[name] = fn(df_transfers, gdf_stops)
+        durations[name] = perf_counter() - start
+        print(f"{name:<10} {durations[name]:>8.2f} s")
+
+    assert np.allclose(results["apply"], results["vectorized"]), "results differ"
+    print(f"speedup: {durations['apply'] / durations['vectorized']:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
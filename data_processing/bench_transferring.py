@@ -0,0 +1,98 @@
+"""
+Benchmark the columnar transfer generation of 05_transferring.py against the
+previous implementation that built one DataFrame per source stop.
+
+Usage: python bench_transferring.py [number of stops]
+"""
+
+from importlib import import_module
+from time import perf_counter
+import sys
+import tracemalloc
+
+import geopandas as gp
+import numpy as np
+import pandas as pd
+
+transferring = import_module("05_transferring")
+
+
+def legacy_generate_for_chunk(chunk: gp.GeoDataFrame, radius: float):
+    """Per-stop implementation as it was before the columnar path."""
+    for row in chunk.itertuples():
+        copy_df = chunk[["stop_id", "geometry"]].copy()
+        copy_df["distance"] = chunk.distance(row.geometry)
+        nearby_stops = copy_df[(copy_df["distance"] < radius)][
+            ["stop_id", "distance"]
+        ].copy()
+        if len(nearby_stops) == 0:
+            continue
+
+        nearby_stops["from_stop_id"] = row.stop_id
+        nearby_stops["transfer_type"] = 2
+        nearby_stops["distance"] /= 1.111111
+        nearby_stops.rename(
+            columns={"stop_id": "to_stop_id", "distance": "min_transfer_time"},
+            inplace=True,
+        )
+        nearby_stops["min_transfer_time"] = np.ceil(nearby_stops["min_transfer_time"])
+        nearby_stops.loc[
+            nearby_stops["min_transfer_time"] < 120, ["min_transfer_time"]
+        ] = 120
+        yield nearby_stops[
+            ["from_stop_id", "to_stop_id", "transfer_type", "min_transfer_time"]
+        ]
+
+
+def legacy(gdf_stops: gp.GeoDataFrame, radius: float) -> pd.DataFrame:
+    return pd.concat(legacy_generate_for_chunk(gdf_stops, radius))
+
+
+def columnar(gdf_stops: gp.GeoDataFrame, radius: float) -> pd.DataFrame:
+    return transferring.generate_for_chunk(gdf_stops, radius)
+
+
+def random_stops(n: int, width: float = 25_000) -> gp.GeoDataFrame:
+    rng = np.random.default_rng(42)
+    return gp.GeoDataFrame(
+        {"stop_id": [f"de:{i}" for i in range(n)]},
+        geometry=gp.points_from_xy(rng.uniform(0, width, n), rng.uniform(0, width, n)),
+        crs="EPSG:25832",
+    )
+
+
+def measure(fn, gdf_stops: gp.GeoDataFrame, radius: float):
+    tracemalloc.start()
+    start = perf_counter()
+    df = fn(gdf_stops, radius)
+    duration = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, duration, peak
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    radius = 250
+    gdf_stops = random_stops(n)
+
+    print(f"{n} stops, radius {radius} m")
+    print(f"{'':<10} {'rows':>10} {'total s':>10} {'µs/stop':>10} {'peak MiB':>10}")
+
+    results = {}
+    for name, fn in [("legacy", legacy), ("columnar", columnar)]:
+        df, duration, peak = measure(fn, gdf_stops, radius)
+        results[name] = df
+        print(
+            f"{name:<10} {len(df):>10} {duration:>10.2f} "
+            f"{duration / n * 1e6:>10.1f} {peak / 2**20:>10.1f}"
+        )
+
+    key = ["from_stop_id", "to_stop_id"]
+    assert results["legacy"].sort_values(key).values.tolist() == (
+        results["columnar"].sort_values(key).values.tolist()
+    ), "results differ"
+
+
+if __name__ == "__main__":
+    main()
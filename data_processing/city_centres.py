@@ -0,0 +1,139 @@
+"""
+Shared list of the city centre stations that journeys lead to.
+
+In version 2 of the per-stop files, destinations reference a city centre station
+by its index in data/city_centres.json ({"ref": 3, "time": 810, "trans": 1})
+instead of repeating its id, name and coordinates in every entry. Destinations
+that are not in the list (added by 14 and 15) keep the full entry.
+"""
+
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pandas as pd
+import ujson as json
+
+
+CITY_CENTRES_FILE = Path("data/city_centres.json")
+
+FORMAT_VERSION = 2
+
+
+class CityCentres:
+    def __init__(self, centres: list[dict]):
+        self.centres = centres
+        self.index = {(c["id"], c["name"]): i for i, c in enumerate(centres)}
+
+    @classmethod
+    def from_frame(cls, stations: pd.DataFrame) -> "CityCentres":
+        """Build the list from destinations (columns id, name, lat and lon)."""
+        stations = stations.drop_duplicates(subset=["id", "name"]).sort_values(
+            ["name", "id"]
+        )
+        return cls(
+            [
+                {"id": id, "name": name, "coord": [lat, lon]}
+                for id, name, lat, lon in zip(
+                    stations["id"],
+                    stations["name"],
+                    stations["lat"].tolist(),
+                    stations["lon"].tolist(),
+                )
+            ]
+        )
+
+    @classmethod
+    def load(cls, path: Path = CITY_CENTRES_FILE) -> "CityCentres":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def save(self, path: Path = CITY_CENTRES_FILE):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.centres, f, ensure_ascii=False)
+
+    def records(self, destinations: pd.DataFrame) -> list[str]:
+        """
+        Serialize destinations (columns id, name, time and trans) to one JSON
+        object per row referencing the city centre.
+        """
+        refs = pd.Series(
+            list(zip(destinations["id"], destinations["name"])), dtype="object"
+        ).map(self.index)
+        if refs.isna().any():
+            raise KeyError("Destination missing from the city centres")
+
+        df = pd.DataFrame(
+            {
+                "ref": refs.to_numpy(dtype="int64"),
+                "time": destinations["time"].to_numpy(),
+                "trans": destinations["trans"].to_numpy(),
+            }
+        )
+        lines = df.to_json(orient="records", lines=True)
+        # JSON strings cannot contain raw line breaks
+        return lines.split("\n")[: len(df)]
+
+    def encode(self, destination: dict) -> dict:
+        """Replace id, name and coordinates of a destination by a reference."""
+        ref = self.index.get((destination["id"], destination["name"]))
+        if ref is None:
+            return destination
+
+        encoded = {"ref": ref}
+        for key, value in destination.items():
+            if key not in ("id", "name", "coord", "coords"):
+                encoded[key] = value
+        return encoded
+
+    def decode(self, destination: dict) -> dict:
+        """Expand a destination referencing a city centre to the full entry."""
+        if "ref" not in destination:
+            return destination
+
+        centre = self.centres[destination["ref"]]
+        decoded = {"id": centre["id"], "name": centre["name"]}
+        for key, value in destination.items():
+            if key != "ref":
+                decoded[key] = value
+        decoded["coord"] = centre["coord"]
+        return decoded
+
+    def decode_stop(self, data: dict) -> dict:
+        """Convert a per-stop file of version 2 to the previous format."""
+        if data.get("version") != FORMAT_VERSION:
+            return data
+
+        travel_times = {
+            label_day: {
+                label_time: [self.decode(d) for d in destinations]
+                for label_time, destinations in times.items()
+            }
+            for label_day, times in data["travelTimes"].items()
+        }
+        return {"stopInfo": data["stopInfo"], "travelTimes": travel_times}
+
+
+def is_encoded(data: dict) -> bool:
+    return data.get("version") == FORMAT_VERSION
+
+
+def load_city_centres(directories: Iterable) -> Optional[CityCentres]:
+    """
+    Load the city centres, or None if CITY_CENTRES_FILE does not exist. Raises
+    a FileNotFoundError if it is missing but the stop files in the directories
+    (each written in one format, so only the first is checked) need it.
+    """
+    if CITY_CENTRES_FILE.exists():
+        return CityCentres.load()
+
+    for directory in directories:
+        for path in Path(directory).glob("*.json"):
+            with open(path, "r", encoding="utf-8") as f:
+                if is_encoded(json.load(f)):
+                    raise FileNotFoundError(
+                        f"{path} references the city centres in "
+                        f"{CITY_CENTRES_FILE}, which is missing "
+                        "(written by 11_merging.py)"
+                    )
+            break
+    return None
@@ -0,0 +1,81 @@
+"""
+Read single tables from a GTFS zip file without parsing the whole feed.
+"""
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Generator
+from zipfile import ZipFile
+
+import pandas as pd
+
+
+# explicit dtypes for the columns used in the pipeline, all other columns are
+# read as strings
+DTYPES = {
+    "stop_lat": "float64",
+    "stop_lon": "float64",
+    "location_type": "Int8",
+    "wheelchair_boarding": "Int8",
+    "transfer_type": "Int8",
+    "min_transfer_time": "float64",
+    "stop_sequence": "Int32",
+    "pickup_type": "Int8",
+    "drop_off_type": "Int8",
+    "route_type": "Int32",
+    "direction_id": "Int8",
+    "exception_type": "Int8",
+    "monday": "Int8",
+    "tuesday": "Int8",
+    "wednesday": "Int8",
+    "thursday": "Int8",
+    "friday": "Int8",
+    "saturday": "Int8",
+    "sunday": "Int8",
+}
+
+
+def table_member(zf: ZipFile, table: str) -> str:
+    """Find the name of the file for `table` within the zip file."""
+    for name in zf.namelist():
+        if name == f"{table}.txt" or name.endswith(f"/{table}.txt"):
+            return name
+    raise KeyError(f"{table}.txt not found in feed")
+
+
+def read_table(
+    feed_file: Path, table: str, usecols: list[str] | None = None
+) -> pd.DataFrame:
+    """Read a single table (e.g. "stops") from the GTFS zip file."""
+    with ZipFile(feed_file) as zf:
+        with zf.open(table_member(zf, table)) as f:
+            return pd.read_csv(
+                f,
+                usecols=usecols,
+                dtype=defaultdict(lambda: "str", DTYPES),
+                encoding="utf-8-sig",
+            )
+
+
+def read_tables(feed_file: Path, tables: list[str]) -> dict[str, pd.DataFrame]:
+    """Read only the given tables from the GTFS zip file."""
+    return {table: read_table(feed_file, table) for table in tables}
+
+
+def read_table_chunks(
+    feed_file: Path, table: str, chunk_size: int, raw: bool = False
+) -> Generator[pd.DataFrame, None, None]:
+    """
+    Read a table from the GTFS zip file in chunks of `chunk_size` rows. With
+    `raw`, all values are kept as the original strings.
+    """
+    if raw:
+        kwargs = {"dtype": "str", "keep_default_na": False}
+    else:
+        kwargs = {"dtype": defaultdict(lambda: "str", DTYPES)}
+
+    with ZipFile(feed_file) as zf:
+        with zf.open(table_member(zf, table)) as f:
+            yield from pd.read_csv(
+                f, chunksize=chunk_size, encoding="utf-8-sig", **kwargs
+            )
@@ -0,0 +1,15 @@
+"""
+Hash input files to key cached intermediate results.
+"""
+
+from pathlib import Path
+import hashlib
+
+
+def file_hash(path: Path, chunk_size: int = 2**20) -> str:
+    """Return the SHA-256 hex digest of the file's content."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
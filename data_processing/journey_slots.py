@@ -0,0 +1,70 @@
+"""
+Day and time slots that 14_vbb.py and 15_google_maps.py request journeys for,
+and helpers to add those journeys to a per-stop file.
+
+Both scripts request the same dates, so a pass with --all-slots fills every slot
+from the week of 2023-02-06. Saturday journeys that earlier runs of 14_vbb.py
+found for 2023-02-04 are kept in its target directory; remove it to request all
+of them for 2023-02-11.
+"""
+
+from argparse import ArgumentParser, Namespace
+from typing import Optional
+
+from city_centres import CityCentres, is_encoded
+
+
+DAYS = {
+    "wednesday": {"name": "Werktag", "date": "2023-02-08"},
+    "saturday": {"name": "Samstag", "date": "2023-02-11"},
+    "sunday": {"name": "Sonntag", "date": "2023-02-12"},
+}
+TIMES = {
+    "day": {"name": "Tag", "start": "08:00:00", "end": "20:00:00"},
+    "night": {"name": "Nacht", "start": "20:00:00", "end": "23:59:59"},
+}
+
+
+def add_slot_arguments(parser: ArgumentParser):
+    parser.add_argument("day", nargs="?", choices=list(DAYS))
+    parser.add_argument("time", nargs="?", choices=list(TIMES))
+    parser.add_argument(
+        "--all-slots",
+        action="store_true",
+        help="request the journeys of all day and time slots in one pass",
+    )
+
+
+def parse_slots(parser: ArgumentParser, args: Namespace) -> list[tuple[dict, dict]]:
+    """The (day, time) slots selected by the arguments of add_slot_arguments."""
+    if args.all_slots:
+        if args.day is not None:
+            parser.error("a day and time cannot be given with --all-slots")
+        return [(day, time) for day in DAYS.values() for time in TIMES.values()]
+
+    if args.time is None:
+        parser.error("a day and time or --all-slots are required")
+    return [(DAYS[args.day], TIMES[args.time])]
+
+
+def add_journey(
+    data: dict, day: dict, time: dict, destination: dict, centres: Optional[CityCentres]
+):
+    if is_encoded(data):
+        destination = centres.encode(destination)
+    data["travelTimes"][day["name"]][time["name"]].append(destination)
+
+
+def has_journey(
+    data: dict, day: dict, time: dict, city_row, centres: Optional[CityCentres]
+) -> bool:
+    """Whether the stop has a journey to the city centre in the slot."""
+    for destination in data["travelTimes"][day["name"]][time["name"]]:
+        if "ref" in destination:
+            destination = centres.decode(destination)
+        if (destination["id"], destination["name"]) == (
+            city_row.stop_id,
+            city_row.stop_name,
+        ):
+            return True
+    return False
@@ -0,0 +1,144 @@
+"""
+Compact binary encoding of a per-stop file, decoded by src/payload.js.
+
+Layout (little endian, every array aligned to its item size):
+
+    magic "RWCB", uint16 version, uint16 reserved, uint32 header length
+    header: UTF-8 JSON {"stopInfo": ..., "stations": [[id, name], ...]},
+            padded with spaces to a multiple of 4 bytes
+    int32[2 * n_stations]  station coordinates (lat, lon) in 1e-6 degrees
+    uint32[6]              number of journeys per slot (see SLOTS)
+    uint16[n]              station of each journey
+    uint16[n]              travel time in seconds
+    uint8[n]               transfers
+    uint8[n]               flags (1: walking)
+
+Every city centre station a stop reaches appears once in the header, instead of
+once per journey and slot.
+"""
+
+from pathlib import Path
+import struct
+
+import numpy as np
+import ujson as json
+
+
+MAGIC = b"RWCB"
+VERSION = 1
+
+SLOTS = [
+    ("Werktag", "Tag"),
+    ("Werktag", "Nacht"),
+    ("Samstag", "Tag"),
+    ("Samstag", "Nacht"),
+    ("Sonntag", "Tag"),
+    ("Sonntag", "Nacht"),
+]
+
+COORD_SCALE = 1e6
+
+FLAG_WALKING = 1
+
+
+def encode_stop(data: dict) -> bytes:
+    """Encode a per-stop file (previous format, see CityCentres.decode_stop)."""
+    stations = {}
+    coords = []
+    counts = []
+    refs = []
+    times = []
+    transfers = []
+    flags = []
+
+    for label_day, label_time in SLOTS:
+        destinations = data["travelTimes"][label_day][label_time]
+        counts.append(len(destinations))
+        for d in destinations:
+            key = (d["id"], d["name"])
+            if key not in stations:
+                stations[key] = len(stations)
+                coords.extend(d["coord"] if "coord" in d else d["coords"])
+            refs.append(stations[key])
+            times.append(round(d["time"]))
+            transfers.append(d["trans"])
+            flags.append(FLAG_WALKING if d.get("walking") else 0)
+
+    if len(stations) > np.iinfo("uint16").max:
+        raise ValueError("Too many stations for 16 bit references")
+
+    header = json.dumps(
+        {"stopInfo": data["stopInfo"], "stations": [list(k) for k in stations]},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    header += b" " * (-len(header) % 4)
+
+    return b"".join(
+        [
+            MAGIC,
+            struct.pack("<HHI", VERSION, 0, len(header)),
+            header,
+            np.round(np.array(coords, dtype="float64") * COORD_SCALE)
+            .astype("<i4")
+            .tobytes(),
+            np.array(counts, dtype="<u4").tobytes(),
+            np.array(refs, dtype="<u2").tobytes(),
+            np.array(times, dtype="<u2").tobytes(),
+            np.array(transfers, dtype="u1").tobytes(),
+            np.array(flags, dtype="u1").tobytes(),
+        ]
+    )
+
+
+def decode_stop(payload: bytes) -> dict:
+    """Decode a payload to the previous per-stop format."""
+    if payload[:4] != MAGIC:
+        raise ValueError("Not a stop payload")
+    version, _, header_length = struct.unpack_from("<HHI", payload, 4)
+    if version != VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+
+    offset = 12
+    header = json.loads(payload[offset : offset + header_length].decode("utf-8"))
+    offset += header_length
+
+    def take(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    stations = header["stations"]
+    coords = (take("<i4", 2 * len(stations)) / COORD_SCALE).reshape(-1, 2).tolist()
+    counts = take("<u4", len(SLOTS))
+    n = int(counts.sum())
+    refs = take("<u2", n).tolist()
+    times = take("<u2", n).tolist()
+    transfers = take("u1", n).tolist()
+    flags = take("u1", n).tolist()
+
+    travel_times = {label_day: {} for label_day, _ in SLOTS}
+    start = 0
+    for (label_day, label_time), count in zip(SLOTS, counts.tolist()):
+        destinations = []
+        for i in range(start, start + count):
+            station_id, name = stations[refs[i]]
+            d = {
+                "id": station_id,
+                "name": name,
+                "time": times[i],
+                "trans": transfers[i],
+                "coord": coords[refs[i]],
+            }
+            if flags[i] & FLAG_WALKING:
+                d["walking"] = True
+            destinations.append(d)
+        travel_times[label_day][label_time] = destinations
+        start += count
+
+    return {"stopInfo": header["stopInfo"], "travelTimes": travel_times}
+
+
+def write_payload(data: dict, path: Path):
+    with open(path, "wb") as f:
+        f.write(encode_stop(data))
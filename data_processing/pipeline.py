@@ -0,0 +1,371 @@
+"""
+Run the numbered processing scripts as an incremental pipeline.
+
+Each step declares its input and output files (or directories). A step is skipped
+if the hash of its command, script and inputs matches the one stored after its last
+successful run and all of its outputs exist. Independent steps run in parallel,
+except for the steps of 08, 10a and 10b: each of them starts a pool with a worker
+process per core (and 08 builds its own timetable), so they run one at a time,
+next to at most the other, lighter steps.
+
+The R scripts 00-03 (stop statistics and blacklist) involve manual review and are
+not part of the pipeline. Google Maps requests (15_google_maps.py) cost money, so
+that step only runs when given explicitly or with --all.
+
+Usage: python pipeline.py [--jobs N] [--all] [--force] [step ...]
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+from hashing import file_hash
+
+
+BASE_DIR = Path(__file__).parent
+DATA_DIR = Path("data")
+STATE_FILE = DATA_DIR / "pipeline_state.json"
+
+FEED = DATA_DIR / "20230109_fahrplaene_gesamtdeutschland_gtfs.zip"
+PREPROCESSED_FEED = DATA_DIR / "20230109_preprocessed.zip"
+CITIES = DATA_DIR / "Public-Transport-2023-cities.csv"
+
+DAYS = ["wednesday", "saturday", "sunday"]
+TIMES = ["day", "night"]
+
+
+@dataclass
+class Step:
+    name: str
+    command: list[str]
+    inputs: list[Path]
+    outputs: list[Path]
+    default: bool = True
+    # the step uses all cores, so it never runs alongside another such step
+    exclusive: bool = False
+    deps: set[str] = field(default_factory=set)
+
+
+def python(script: str, *args: str) -> list[str]:
+    return [sys.executable, script, *args]
+
+
+def define_steps() -> list[Step]:
+    steps = [
+        Step(
+            "04",
+            python("04_statting.py"),
+            [DATA_DIR / "stats_long_corrected.csv"],
+            [DATA_DIR / "stops.json", DATA_DIR / "stops_with_coords.json"],
+        ),
+        Step(
+            "05",
+            python("05_transferring.py"),
+            [FEED, DATA_DIR / "germany.geojson"],
+            [DATA_DIR / "new_transfers.csv", DATA_DIR / "new_transfers_same_name.csv"],
+        ),
+        Step(
+            "06",
+            python("06_teleporting.py"),
+            [FEED],
+            [DATA_DIR / "faulty_transfers.csv"],
+        ),
+        Step(
+            "07",
+            python("07_prepping.py", "--streaming"),
+            [
+                FEED,
+                DATA_DIR / "faulty_transfers.csv",
+                DATA_DIR / "new_transfers.csv",
+                DATA_DIR / "new_transfers_same_name.csv",
+                DATA_DIR / "blacklist_ids.txt",
+                DATA_DIR / "rename.csv",
+            ],
+            [PREPROCESSED_FEED],
+        ),
+    ]
+
+    for day in DAYS:
+        for time in TIMES:
+            steps.append(
+                Step(
+                    f"08_{day}_{time}",
+                    python("08_routing.py", day, time),
+                    [PREPROCESSED_FEED, CITIES],
+                    [DATA_DIR / f"travel_times_{day}_{time}_arrival"],
+                    exclusive=True,
+                )
+            )
+            steps.append(
+                Step(
+                    f"10a_{day}_{time}",
+                    python("10a_processing.py", day, time),
+                    [DATA_DIR / f"travel_times_{day}_{time}_arrival"],
+                    [DATA_DIR / f"travel_times_{day}_{time}"],
+                    exclusive=True,
+                )
+            )
+            steps.append(
+                Step(
+                    f"10b_{day}_{time}",
+                    python("10b_processing.py", day, time),
+                    [
+                        DATA_DIR / f"travel_times_{day}_{time}",
+                        PREPROCESSED_FEED,
+                        DATA_DIR / "gemeinden_be_bb_geo.json",
+                    ],
+                    [
+                        DATA_DIR / f"travel_times_proc_{day}_{time}_combine",
+                        DATA_DIR / f"travel_times_proc_{day}_{time}_dataset",
+                    ],
+                    exclusive=True,
+                )
+            )
+
+    steps += [
+        Step(
+            "11",
+            python("11_merging.py", "--columnar"),
+            [DATA_DIR / "stops_with_coords.json"]
+            + [
+                DATA_DIR / f"travel_times_proc_{day}_{time}_dataset"
+                for day in DAYS
+                for time in TIMES
+            ],
+            [
+                DATA_DIR / "merged",
+                DATA_DIR / "merged_summary.csv",
+                DATA_DIR / "city_centres.json",
+            ],
+        ),
+        Step(
+            "12",
+            python("12_dead_stations.py"),
+            [DATA_DIR / "merged_summary.csv"],
+            [DATA_DIR / "dead_stations.csv", DATA_DIR / "dead_stations.geojson"],
+        ),
+        Step(
+            "13",
+            python("13_cities_nearby_dead_stations.py"),
+            [DATA_DIR / "dead_stations.csv", CITIES],
+            [DATA_DIR / "cities_nearby_dead_stations.csv"],
+        ),
+    ]
+
+    # 14 and 15 request all day and time slots in one run each
+    steps += [
+        Step(
+            "14",
+            python("14_vbb.py", "--all-slots"),
+            [
+                DATA_DIR / "merged",
+                DATA_DIR / "merged_summary.csv",
+                DATA_DIR / "city_centres.json",
+                DATA_DIR / "cities_nearby_dead_stations.csv",
+            ],
+            [DATA_DIR / "with_vbb_data", DATA_DIR / "with_vbb_data_summary.csv"],
+        ),
+        Step(
+            "15",
+            python("15_google_maps.py", "--all-slots"),
+            [
+                DATA_DIR / "merged",
+                DATA_DIR / "with_vbb_data",
+                DATA_DIR / "with_vbb_data_summary.csv",
+                DATA_DIR / "city_centres.json",
+                DATA_DIR / "cities_nearby_dead_stations.csv",
+            ],
+            [
+                DATA_DIR / "with_google_maps_data",
+                DATA_DIR / "with_google_maps_data_summary.csv",
+            ],
+            default=False,
+        ),
+        Step(
+            "16",
+            python("16_merge.py"),
+            [
+                DATA_DIR / "merged",
+                DATA_DIR / "merged_summary.csv",
+                DATA_DIR / "with_vbb_data",
+                DATA_DIR / "with_google_maps_data",
+                DATA_DIR / "city_centres.json",
+            ],
+            [DATA_DIR / "with_google_maps_data.json"],
+        ),
+    ]
+
+    add_dependencies(steps)
+    return steps
+
+
+def add_dependencies(steps: list[Step]):
+    """
+    A step depends on every earlier step that writes one of its inputs or one of
+    its outputs (steps sharing a target directory run in the given order).
+    """
+    for i, step in enumerate(steps):
+        for earlier in steps[:i]:
+            if set(earlier.outputs) & (set(step.inputs) | set(step.outputs)):
+                step.deps.add(earlier.name)
+
+
+class Hasher:
+    """Hash files and directories, reusing hashes of unchanged files."""
+
+    def __init__(self):
+        self.cache = {}
+
+    def file(self, path: Path) -> str:
+        stat = path.stat()
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self.cache:
+            self.cache[key] = file_hash(path)
+        return self.cache[key]
+
+    def path(self, path: Path) -> str:
+        if path.is_file():
+            return self.file(path)
+        if path.is_dir():
+            h = hashlib.sha256()
+            for p in sorted(path.rglob("*")):
+                if p.is_file():
+                    h.update(str(p.relative_to(path)).encode("utf-8"))
+                    h.update(self.file(p).encode("ascii"))
+            return h.hexdigest()
+        return "missing"
+
+    def step(self, step: Step) -> str:
+        h = hashlib.sha256()
+        h.update(json.dumps(step.command[1:]).encode("utf-8"))
+        h.update(self.file(Path(step.command[1])).encode("ascii"))
+        for path in step.inputs:
+            h.update(str(path).encode("utf-8"))
+            h.update(self.path(path).encode("ascii"))
+        return h.hexdigest()
+
+
+def load_state() -> dict:
+    if STATE_FILE.exists():
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state: dict):
+    with open(STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def run_step(
+    step: Step, hasher: Hasher, state: dict, force: bool
+) -> tuple[str, str]:
+    """
+    Run a step unless it is up to date. Returns "skipped", "done" or "failed"
+    and the step's key, which the caller records in the state once it is done.
+    """
+    key = hasher.step(step)
+    if (
+        not force
+        and state.get(step.name) == key
+        and all(path.exists() for path in step.outputs)
+    ):
+        return "skipped", key
+
+    print(f"[{step.name}] {' '.join(step.command)}", flush=True)
+    log_file = DATA_DIR / "logs" / f"{step.name}.log"
+    log_file.parent.mkdir(exist_ok=True)
+    with open(log_file, "w", encoding="utf-8") as log:
+        result = subprocess.run(step.command, stdout=log, stderr=subprocess.STDOUT)
+
+    if result.returncode != 0:
+        print(f"[{step.name}] failed, see {log_file}", file=sys.stderr)
+        return "failed", key
+
+    return "done", key
+
+
+def run(steps: list[Step], jobs: int, force: bool):
+    hasher = Hasher()
+    state = load_state()
+    by_name = {step.name: step for step in steps}
+    status = {}
+    pending = dict(by_name)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for name, step in list(pending.items()):
+                # dependencies outside the selection count as finished
+                deps = [d for d in step.deps if d in by_name]
+                if any(status.get(d) in ("failed", "blocked") for d in deps):
+                    status[name] = "blocked"
+                    del pending[name]
+                elif step.exclusive and any(
+                    by_name[r].exclusive for r in running.values()
+                ):
+                    continue
+                elif all(d in status for d in deps):
+                    fut = executor.submit(run_step, step, hasher, state, force)
+                    running[fut] = name
+                    del pending[name]
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name = running.pop(fut)
+                status[name], key = fut.result()
+                if status[name] == "done":
+                    state[name] = key
+                print(f"[{name}] {status[name]}", flush=True)
+                save_state(state)
+
+    for result in ["done", "skipped", "failed", "blocked"]:
+        names = [name for name in by_name if status.get(name) == result]
+        print(f"{result}: {len(names)} {' '.join(names)}")
+
+    return all(s in ("done", "skipped") for s in status.values())
+
+
+def main():
+    parser = ArgumentParser(
+        description="Run the data processing pipeline incrementally."
+    )
+    parser.add_argument(
+        "steps",
+        nargs="*",
+        help="steps to run (prefixes like 10b or 08_sunday), default all",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(), help="parallel steps"
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="include paid Google Maps steps"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="run steps even if up to date"
+    )
+    args = parser.parse_args()
+
+    os.chdir(BASE_DIR)
+    steps = define_steps()
+
+    if args.steps:
+        steps = [s for s in steps if any(s.name.startswith(p) for p in args.steps)]
+    elif not args.all:
+        steps = [s for s in steps if s.default]
+
+    ok = run(steps, args.jobs, args.force)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
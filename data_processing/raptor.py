@@ -0,0 +1,633 @@
+"""
+Arrival-based RAPTOR over a GTFS feed packed into contiguous NumPy arrays.
+
+The timetable of one service day is grouped into routes (trips with the same stop
+sequence that do not overtake each other). Arrival and departure times of a route
+are stored stop-major in one int32 array, so the trips' times at a stop are one
+contiguous, sorted slice.
+
+Queries run backwards from a set of target stops: for an arrival time at the
+target, they find the latest departure from every other stop with at most
+`max_transfers` transfers. Memory only depends on the number of stops and rounds,
+not on the target.
+
+To route to many targets in parallel, the timetable is saved as .npy files that
+worker processes map read-only, so all of them share one copy in memory.
+"""
+
+from dataclasses import dataclass, fields
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from gtfs_io import read_table, read_table_chunks
+
+
+NO_TIME = np.iinfo(np.int32).min
+
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+
+@dataclass
+class Timetable:
+    # stops
+    stop_ids: np.ndarray
+    stop_names: np.ndarray
+    stop_lats: np.ndarray
+    stop_lons: np.ndarray
+
+    # routes: stops of route r are route_stops[route_stop_offsets[r]:...[r + 1]],
+    # the time of trip t at position i is times[route_time_offsets[r] + i * n + t]
+    # with n = route_trip_counts[r]
+    route_stop_offsets: np.ndarray
+    route_stops: np.ndarray
+    route_trip_counts: np.ndarray
+    route_time_offsets: np.ndarray
+    arrivals: np.ndarray
+    departures: np.ndarray
+
+    # routes serving stop s (and the stop's position within the route) are at
+    # stop_route_offsets[s]:stop_route_offsets[s + 1]
+    stop_route_offsets: np.ndarray
+    stop_routes: np.ndarray
+    stop_route_positions: np.ndarray
+
+    # footpaths arriving at stop s are at footpath_offsets[s]:footpath_offsets[s + 1]
+    footpath_offsets: np.ndarray
+    footpath_from: np.ndarray
+    footpath_times: np.ndarray
+
+    @property
+    def n_stops(self) -> int:
+        return len(self.stop_ids)
+
+    def stops_by_name(self, stop_name: str) -> np.ndarray:
+        return np.flatnonzero(self.stop_names == stop_name)
+
+
+def save_timetable(tt: Timetable, directory: Path):
+    """Save the timetable arrays as one .npy file per field."""
+    directory.mkdir(parents=True, exist_ok=True)
+    for f in fields(Timetable):
+        np.save(directory / f"{f.name}.npy", getattr(tt, f.name))
+
+
+def open_timetable(directory: Path) -> Timetable:
+    """
+    Open a timetable saved with save_timetable. The arrays are memory-mapped
+    read-only, so processes opening the same directory share the pages.
+    """
+    # plain ndarray views avoid the overhead of indexing np.memmap objects
+    return Timetable(
+        **{
+            f.name: np.asarray(np.load(directory / f"{f.name}.npy", mmap_mode="r"))
+            for f in fields(Timetable)
+        }
+    )
+
+
+def parse_times(times: pd.Series) -> np.ndarray:
+    """Convert GTFS times (HH:MM:SS, hours may exceed 24) to seconds."""
+    parts = times.str.split(":", expand=True).astype("int32")
+    return (parts[0] * 3600 + parts[1] * 60 + parts[2]).to_numpy(dtype="int32")
+
+
+def active_services(feed_file: Path, day: date) -> set[str]:
+    """Find the service ids running on `day` from calendar and calendar_dates."""
+    day_str = day.strftime("%Y%m%d")
+    services = set()
+
+    try:
+        calendar = read_table(feed_file, "calendar")
+        running = calendar[
+            (calendar[WEEKDAYS[day.weekday()]] == 1)
+            & (calendar["start_date"] <= day_str)
+            & (calendar["end_date"] >= day_str)
+        ]
+        services.update(running["service_id"])
+    except KeyError:
+        pass
+
+    try:
+        calendar_dates = read_table(feed_file, "calendar_dates")
+        exceptions = calendar_dates[calendar_dates["date"] == day_str]
+        services.update(exceptions[exceptions.exception_type == 1].service_id)
+        services.difference_update(
+            exceptions[exceptions.exception_type == 2].service_id
+        )
+    except KeyError:
+        pass
+
+    return services
+
+
+def load_timetable(
+    feed_file: Path,
+    day: date,
+    start_time: int,
+    end_time: int,
+    chunk_size: int = 1_000_000,
+) -> Timetable:
+    """
+    Load the stop times of trips running on `day` that depart after `start_time`
+    and arrive before `end_time` (like tidytransit's filter_stop_times).
+    stop_times.txt is read in chunks, so the whole table is never in memory.
+    """
+    services = active_services(feed_file, day)
+    trips = read_table(feed_file, "trips", usecols=["trip_id", "service_id"])
+    trip_ids = pd.Index(trips.loc[trips.service_id.isin(services), "trip_id"])
+
+    stops = read_table(feed_file, "stops")
+    stop_index = pd.Index(stops["stop_id"])
+
+    chunks = []
+    for chunk in read_table_chunks(feed_file, "stop_times", chunk_size):
+        chunk = chunk[chunk.trip_id.isin(trip_ids)]
+        arrivals = parse_times(chunk["arrival_time"])
+        departures = parse_times(chunk["departure_time"])
+        keep = (departures >= start_time) & (arrivals <= end_time)
+        chunks.append(
+            pd.DataFrame(
+                {
+                    "trip": trip_ids.get_indexer(chunk["trip_id"][keep]),
+                    "sequence": chunk["stop_sequence"][keep].to_numpy(dtype="int32"),
+                    "stop": stop_index.get_indexer(chunk["stop_id"][keep]),
+                    "arrival": arrivals[keep],
+                    "departure": departures[keep],
+                }
+            )
+        )
+    stop_times = pd.concat(chunks, ignore_index=True)
+    stop_times = stop_times[stop_times.stop >= 0]
+
+    transfers = read_table(feed_file, "transfers")
+    transfers = pd.DataFrame(
+        {
+            "from": stop_index.get_indexer(transfers["from_stop_id"]),
+            "to": stop_index.get_indexer(transfers["to_stop_id"]),
+            "time": transfers["min_transfer_time"].to_numpy(),
+        }
+    )
+
+    return build_timetable(stops, stop_times, transfers)
+
+
+def build_timetable(
+    stops: pd.DataFrame, stop_times: pd.DataFrame, transfers: pd.DataFrame
+) -> Timetable:
+    """
+    Pack stop times (columns trip, sequence, stop, arrival, departure as integer
+    codes) and footpaths (columns from, to, time) into a Timetable.
+    """
+    n_stops = len(stops)
+
+    stop_times = stop_times.sort_values(["trip", "sequence"])
+    trip_codes = stop_times["trip"].to_numpy()
+    st_stops = stop_times["stop"].to_numpy(dtype="int32")
+    st_arrivals = stop_times["arrival"].to_numpy(dtype="int32")
+    st_departures = stop_times["departure"].to_numpy(dtype="int32")
+
+    _, trip_starts, trip_lengths = np.unique(
+        trip_codes, return_index=True, return_counts=True
+    )
+
+    # group trips by stop pattern
+    patterns = {}
+    for start, length in zip(trip_starts, trip_lengths):
+        if length < 2:
+            continue
+        key = st_stops[start : start + length].tobytes()
+        patterns.setdefault(key, []).append(start)
+
+    route_stops = []
+    route_trip_counts = []
+    arrivals = []
+    departures = []
+
+    for key, starts in patterns.items():
+        pattern = np.frombuffer(key, dtype="int32")
+        idx = np.array(starts)[:, None] + np.arange(len(pattern))
+        trip_arrivals = st_arrivals[idx]
+        trip_departures = st_departures[idx]
+        order = np.argsort(trip_departures[:, 0], kind="stable")
+
+        for trips in split_overtaking(trip_arrivals[order], trip_departures[order]):
+            route_stops.append(pattern)
+            route_trip_counts.append(len(trips))
+            # stop-major layout
+            arrivals.append(trip_arrivals[order][trips].T.ravel())
+            departures.append(trip_departures[order][trips].T.ravel())
+
+    route_lengths = np.array([len(s) for s in route_stops], dtype="int64")
+    route_stop_offsets = np.concatenate([[0], np.cumsum(route_lengths)])
+    route_trip_counts = np.array(route_trip_counts, dtype="int64")
+    route_time_offsets = np.concatenate(
+        [[0], np.cumsum(route_lengths * route_trip_counts)]
+    )
+    route_stops = (
+        np.concatenate(route_stops) if route_stops else np.empty(0, dtype="int32")
+    )
+
+    # routes per stop
+    routes = np.repeat(np.arange(len(route_lengths), dtype="int32"), route_lengths)
+    positions = np.arange(len(route_stops), dtype="int32") - np.repeat(
+        route_stop_offsets[:-1], route_lengths
+    ).astype("int32")
+    order = np.argsort(route_stops, kind="stable")
+    stop_route_offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(route_stops, minlength=n_stops))]
+    )
+
+    # footpaths between different stops, indexed by the stop they arrive at
+    footpaths = transfers[
+        (transfers["from"] >= 0)
+        & (transfers["to"] >= 0)
+        & (transfers["from"] != transfers["to"])
+        & transfers["time"].notna()
+    ].sort_values("to")
+    footpath_offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(footpaths["to"], minlength=n_stops))]
+    )
+
+    return Timetable(
+        stop_ids=stops["stop_id"].to_numpy(dtype="str"),
+        stop_names=stops["stop_name"].to_numpy(dtype="str"),
+        stop_lats=stops["stop_lat"].to_numpy(dtype="float64"),
+        stop_lons=stops["stop_lon"].to_numpy(dtype="float64"),
+        route_stop_offsets=route_stop_offsets,
+        route_stops=route_stops,
+        route_trip_counts=route_trip_counts,
+        route_time_offsets=route_time_offsets,
+        arrivals=concat_int32(arrivals),
+        departures=concat_int32(departures),
+        stop_route_offsets=stop_route_offsets,
+        stop_routes=routes[order],
+        stop_route_positions=positions[order],
+        footpath_offsets=footpath_offsets,
+        footpath_from=footpaths["from"].to_numpy(dtype="int32"),
+        footpath_times=np.ceil(footpaths["time"].to_numpy()).astype("int32"),
+    )
+
+
+def concat_int32(arrays: list[np.ndarray]) -> np.ndarray:
+    if not arrays:
+        return np.empty(0, dtype="int32")
+    return np.concatenate(arrays).astype("int32")
+
+
+def split_overtaking(arrivals: np.ndarray, departures: np.ndarray) -> list[np.ndarray]:
+    """
+    Split trips (sorted by first departure) into groups in which no trip
+    overtakes another, so the times at every stop are sorted within a group.
+    """
+    groups = []
+    last = []
+    for t in range(len(arrivals)):
+        for g, l in enumerate(last):
+            if np.all(arrivals[t] >= arrivals[l]) and np.all(
+                departures[t] >= departures[l]
+            ):
+                groups[g].append(t)
+                last[g] = t
+                break
+        else:
+            groups.append([t])
+            last.append(t)
+    return [np.array(g) for g in groups]
+
+
+class ReverseRaptor:
+    """
+    Latest departure queries towards a set of target stops. Labels are allocated
+    once per instance and reused between queries.
+    """
+
+    def __init__(self, timetable: Timetable, max_transfers: int = 3):
+        self.tt = timetable
+        self.n_rounds = max_transfers + 1
+        shape = (self.n_rounds + 1, timetable.n_stops)
+        self.labels = np.full(shape, NO_TIME, dtype="int32")
+        self.label_targets = np.full(shape, -1, dtype="int32")
+        self.best = np.full(timetable.n_stops, NO_TIME, dtype="int32")
+        self.best_round = np.full(timetable.n_stops, -1, dtype="int8")
+        self.best_target = np.full(timetable.n_stops, -1, dtype="int32")
+
+    def reset(self):
+        self.labels.fill(NO_TIME)
+        self.label_targets.fill(-1)
+        self.best.fill(NO_TIME)
+        self.best_round.fill(-1)
+        self.best_target.fill(-1)
+
+    def query(self, targets: np.ndarray, arrival_time: int, min_time: int):
+        """
+        Find the latest departure from every stop to reach one of `targets` by
+        `arrival_time`. Departures before `min_time` are ignored. Results are in
+        `best` (departure time), `best_round` (number of trips, 0 for walking)
+        and `best_target` (the target stop reached).
+        """
+        marked = set()
+
+        for s in targets:
+            if arrival_time > self.labels[0, s]:
+                self.labels[0, s] = arrival_time
+                self.label_targets[0, s] = s
+                self.update_best(s, arrival_time, 0, s)
+                marked.add(s)
+        marked |= self.relax_footpaths(marked, 0, min_time)
+
+        for k in range(1, self.n_rounds + 1):
+            if not marked:
+                break
+            self.labels[k] = np.maximum(self.labels[k], self.labels[k - 1])
+            self.label_targets[k] = np.where(
+                self.labels[k] == self.labels[k - 1],
+                self.label_targets[k - 1],
+                self.label_targets[k],
+            )
+            marked = self.scan_routes(marked, k, min_time)
+            marked |= self.relax_footpaths(marked, k, min_time)
+
+    def update_best(self, stop: int, time: int, k: int, target: int):
+        self.best[stop] = time
+        self.best_round[stop] = k
+        self.best_target[stop] = target
+
+    def scan_routes(self, marked: set, k: int, min_time: int) -> set:
+        tt = self.tt
+
+        # for each route, the last position of a marked stop
+        queue = {}
+        for s in marked:
+            for j in range(tt.stop_route_offsets[s], tt.stop_route_offsets[s + 1]):
+                r = tt.stop_routes[j]
+                pos = tt.stop_route_positions[j]
+                if queue.get(r, -1) < pos:
+                    queue[r] = pos
+
+        labels_prev = self.labels[k - 1]
+        targets_prev = self.label_targets[k - 1]
+        labels = self.labels[k]
+        label_targets = self.label_targets[k]
+        best = self.best
+
+        new_marked = set()
+        for r, last_pos in queue.items():
+            stops = tt.route_stops[
+                tt.route_stop_offsets[r] : tt.route_stop_offsets[r + 1]
+            ]
+            n_trips = tt.route_trip_counts[r]
+            offset = tt.route_time_offsets[r]
+
+            trip = -1
+            target = -1
+            for i in range(last_pos, -1, -1):
+                s = stops[i]
+                if trip >= 0:
+                    dep = tt.departures[offset + i * n_trips + trip]
+                    if dep > best[s] and dep >= min_time:
+                        labels[s] = dep
+                        label_targets[s] = target
+                        self.update_best(s, dep, k, target)
+                        new_marked.add(s)
+
+                # alight from a later trip at this stop
+                if labels_prev[s] != NO_TIME:
+                    start = offset + i * n_trips
+                    t = (
+                        np.searchsorted(
+                            tt.arrivals[start : start + n_trips],
+                            labels_prev[s],
+                            side="right",
+                        )
+                        - 1
+                    )
+                    if t > trip:
+                        trip = t
+                        target = targets_prev[s]
+
+        return new_marked
+
+    def relax_footpaths(self, marked: set, k: int, min_time: int) -> set:
+        tt = self.tt
+        labels = self.labels[k]
+        label_targets = self.label_targets[k]
+
+        # walk from the labels reached by trip only, not from other footpaths
+        reached = [(s, labels[s], label_targets[s]) for s in marked]
+
+        new_marked = set()
+        for s, label, target in reached:
+            for j in range(tt.footpath_offsets[s], tt.footpath_offsets[s + 1]):
+                u = tt.footpath_from[j]
+                time = label - tt.footpath_times[j]
+                if time > self.best[u] and time >= min_time:
+                    labels[u] = time
+                    label_targets[u] = target
+                    self.update_best(u, time, k, target)
+                    new_marked.add(u)
+        return new_marked
+
+
+def arrival_times(
+    tt: Timetable, targets: np.ndarray, start_time: int, end_time: int
+) -> np.ndarray:
+    """All times within the window at which a trip (or footpath) reaches a target."""
+    times = []
+    for s in targets:
+        for j in range(tt.stop_route_offsets[s], tt.stop_route_offsets[s + 1]):
+            r = tt.stop_routes[j]
+            n_trips = tt.route_trip_counts[r]
+            start = tt.route_time_offsets[r] + tt.stop_route_positions[j] * n_trips
+            times.append(tt.arrivals[start : start + n_trips])
+
+        for j in range(tt.footpath_offsets[s], tt.footpath_offsets[s + 1]):
+            for i in range(
+                tt.stop_route_offsets[tt.footpath_from[j]],
+                tt.stop_route_offsets[tt.footpath_from[j] + 1],
+            ):
+                r = tt.stop_routes[i]
+                n_trips = tt.route_trip_counts[r]
+                start = tt.route_time_offsets[r] + tt.stop_route_positions[i] * n_trips
+                times.append(
+                    tt.arrivals[start : start + n_trips] + tt.footpath_times[j]
+                )
+
+    if not times:
+        return np.empty(0, dtype="int32")
+    times = np.unique(np.concatenate(times))
+    return times[(times >= start_time) & (times <= end_time)]
+
+
+class Journeys:
+    """Shortest journey per stop, collected over several queries."""
+
+    def __init__(self, n_stops: int):
+        self.travel_time = np.full(n_stops, np.iinfo(np.int32).max, dtype="int32")
+        self.departure = np.full(n_stops, NO_TIME, dtype="int32")
+        self.arrival = np.full(n_stops, NO_TIME, dtype="int32")
+        self.transfers = np.full(n_stops, -1, dtype="int8")
+        self.target = np.full(n_stops, -1, dtype="int32")
+
+    def update(self, raptor: ReverseRaptor, arrival_time: int):
+        reached = raptor.best != NO_TIME
+        travel_time = np.where(reached, arrival_time - raptor.best.astype("int64"), 0)
+        transfers = np.maximum(raptor.best_round - 1, 0)
+        better = reached & (
+            (travel_time < self.travel_time)
+            | ((travel_time == self.travel_time) & (transfers < self.transfers))
+        )
+        self.travel_time[better] = travel_time[better]
+        self.departure[better] = raptor.best[better]
+        self.arrival[better] = arrival_time
+        self.transfers[better] = transfers[better]
+        self.target[better] = raptor.best_target[better]
+
+    def to_frame(self, tt: Timetable, max_travel_time: int) -> pd.DataFrame:
+        """
+        Shortest journey per origin stop name, in the format of tidytransit's
+        travel_times with return_coords = TRUE.
+        """
+        stops = np.flatnonzero(
+            (self.target >= 0) & (self.travel_time <= max_travel_time)
+        )
+        targets = self.target[stops]
+        df = pd.DataFrame(
+            {
+                "from_stop_name": tt.stop_names[stops],
+                "to_stop_name": tt.stop_names[targets],
+                "travel_time": self.travel_time[stops],
+                "journey_departure_time": format_times(self.departure[stops]),
+                "journey_arrival_time": format_times(self.arrival[stops]),
+                "transfers": self.transfers[stops].astype("int32"),
+                "from_stop_id": tt.stop_ids[stops],
+                "to_stop_id": tt.stop_ids[targets],
+                "from_stop_lon": tt.stop_lons[stops],
+                "from_stop_lat": tt.stop_lats[stops],
+                "to_stop_lon": tt.stop_lons[targets],
+                "to_stop_lat": tt.stop_lats[targets],
+            }
+        )
+        return (
+            df.sort_values(["travel_time", "transfers"], kind="stable")
+            .drop_duplicates(subset=["from_stop_name"])
+            .reset_index(drop=True)
+        )
+
+
+def format_times(seconds: np.ndarray) -> np.ndarray:
+    return np.array(
+        [
+            f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}"
+            for s in seconds.tolist()
+        ],
+        dtype="str",
+    )
+
+
+def travel_times(
+    tt: Timetable,
+    stop_name: str,
+    start_time: int,
+    end_time: int,
+    max_transfers: int = 3,
+    max_travel_time: int = 60 * 60,
+    profile: bool = True,
+) -> pd.DataFrame:
+    """
+    Shortest travel time from every stop to the stops named `stop_name`, for
+    journeys arriving within the time window.
+
+    One query is run for every arrival at the target. With `profile` (the
+    reverse of rRAPTOR), arrivals are processed from earliest to latest and the
+    labels of earlier queries are kept: a journey reaching the target by an
+    earlier time also reaches it by a later one, so each query only has to
+    explore departures later than the ones already found. Without `profile`,
+    every query starts from scratch.
+    """
+    targets = tt.stops_by_name(stop_name)
+    if len(targets) == 0:
+        raise KeyError(f"Stop {stop_name} not found")
+
+    raptor = ReverseRaptor(tt, max_transfers)
+    journeys = Journeys(tt.n_stops)
+
+    # arrival_times are sorted in ascending order
+    for arrival_time in arrival_times(tt, targets, start_time, end_time):
+        if not profile:
+            raptor.reset()
+        min_time = max(start_time, arrival_time - max_travel_time)
+        raptor.query(targets, arrival_time, min_time)
+        journeys.update(raptor, arrival_time)
+
+    return journeys.to_frame(tt, max_travel_time)
+
+
+_worker_timetable: Optional[Timetable] = None
+_worker_options: dict = {}
+
+
+def _init_worker(directory: Path, options: dict):
+    global _worker_timetable, _worker_options
+    _worker_timetable = open_timetable(directory)
+    _worker_options = options
+
+
+def _route_target(stop_name: str):
+    try:
+        df = travel_times(_worker_timetable, stop_name, **_worker_options)
+    except Exception as e:
+        return stop_name, None, e
+    return stop_name, df, None
+
+
+def travel_times_batch(
+    timetable_dir: Path,
+    stop_names: Iterable[str],
+    start_time: int,
+    end_time: int,
+    max_transfers: int = 3,
+    max_travel_time: int = 60 * 60,
+    processes: Optional[int] = None,
+) -> Iterator[tuple[str, Optional[pd.DataFrame], Optional[Exception]]]:
+    """
+    Route to all `stop_names` with a pool of worker processes sharing the
+    timetable saved in `timetable_dir`. Yields (stop_name, travel times, error)
+    per target as soon as it is finished, in no particular order. If a worker
+    dies (e.g. killed for running out of memory), the targets not finished yet
+    are yielded with the error.
+
+    The timetable is filtered and built only once, but each target still gets
+    its own profile sweep: the labels of a reverse search depend on the
+    target, so sweeping all targets together would need a label array per
+    target and round and could no longer hand finished targets to the caller
+    one by one. Running the sweeps side by side over the shared arrays keeps
+    memory per worker at one set of labels.
+    """
+    options = {
+        "start_time": start_time,
+        "end_time": end_time,
+        "max_transfers": max_transfers,
+        "max_travel_time": max_travel_time,
+    }
+    with ProcessPoolExecutor(
+        processes, initializer=_init_worker, initargs=(timetable_dir, options)
+    ) as executor:
+        futures = {executor.submit(_route_target, name): name for name in stop_names}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield futures[future], None, e
@@ -0,0 +1,127 @@
+"""
+Persistent cache of API responses, shared by 14_vbb.py and 15_google_maps.py, so
+reruns do not repeat (or pay for) requests that were answered before.
+
+Responses are stored in an SQLite database keyed by the endpoint URL and the
+sorted request parameters. Parameters holding credentials (the Google API key)
+are left out of the key and of the stored URL. Entries expire after a time to
+live, and the least recently used entries are evicted once the cached responses
+exceed a size limit.
+"""
+
+from pathlib import Path
+from threading import Lock
+from time import time
+from urllib.parse import urlencode, urlsplit, urlunsplit
+import hashlib
+import json
+import sqlite3
+
+
+CACHE_FILE = Path("data/cache/requests.sqlite")
+
+TTL = 30 * 24 * 60 * 60  # s
+MAX_BYTES = 512 * 2**20
+
+# parameters that do not change the response
+IGNORED_PARAMS = {"key"}
+
+
+class CachedResponse:
+    """The parts of a requests.Response the scripts use."""
+
+    def __init__(self, url: str, status_code: int, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def normalize(url: str, params: dict = None) -> str:
+    """The URL with sorted parameters, without the ignored ones."""
+    scheme, netloc, path, query, _ = urlsplit(url)
+    items = sorted(
+        (str(k), str(v)) for k, v in (params or {}).items() if k not in IGNORED_PARAMS
+    )
+    return urlunsplit(
+        (scheme.lower(), netloc.lower(), path.rstrip("/") or "/", urlencode(items), "")
+    )
+
+
+class RequestCache:
+    def __init__(
+        self, path: Path = CACHE_FILE, ttl: float = TTL, max_bytes: int = MAX_BYTES
+    ):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # the connection is shared by threads, guarded by the lock
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT,"
+            " status INTEGER, content BLOB, size INTEGER, created REAL, used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        with self.db:
+            self.db.execute(
+                "DELETE FROM responses WHERE created < ?", (time() - self.ttl,)
+            )
+
+    def get(self, url: str, params: dict = None):
+        """The cached response to a request, or None."""
+        url = normalize(url, params)
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT status, content, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[2] < time() - self.ttl:
+                self.misses += 1
+                return None
+            self.db.execute(
+                "UPDATE responses SET used = ? WHERE key = ?", (time(), key)
+            )
+            self.hits += 1
+        return CachedResponse(url, row[0], row[1])
+
+    def put(self, url: str, params: dict, response):
+        """Store the response to a request and evict entries above the limit."""
+        url = normalize(url, params)
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        content = response.content
+        now = time()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, response.status_code, content, len(content), now, now),
+            )
+            (size,) = self.db.execute("SELECT SUM(size) FROM responses").fetchone()
+            if size > self.max_bytes:
+                self.evict(size - self.max_bytes)
+
+    def evict(self, n_bytes: int):
+        """Delete the least recently used entries holding at least n_bytes."""
+        keys = []
+        for key, size in self.db.execute(
+            "SELECT key, size FROM responses ORDER BY used"
+        ):
+            keys.append((key,))
+            n_bytes -= size
+            if n_bytes <= 0:
+                break
+        self.db.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+    def report(self):
+        total = self.hits + self.misses
+        share = self.hits / total if total else 0
+        print(f"request cache: {self.hits} hits, {self.misses} misses ({share:.0%})")
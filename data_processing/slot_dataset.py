@@ -0,0 +1,154 @@
+"""
+Columnar copy of the per-stop files of one day and time slot (10b_processing.py),
+so 11_merging.py can read a slot with one file read instead of one per stop.
+
+A slot's dataset is a directory with two Parquet files:
+- stops.parquet: the stop_info of every stop file (name, id, lat, lon)
+- destinations.parquet: the destinations of all stops, with the name of the stop
+  they belong to in from_stop_name
+"""
+
+from pathlib import Path
+from typing import Optional
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+DATA_DIR = Path("data")
+
+STOPS_SCHEMA = pa.schema(
+    [
+        ("name", pa.string()),
+        ("id", pa.string()),
+        ("lat", pa.float64()),
+        ("lon", pa.float64()),
+    ]
+)
+DESTINATIONS_SCHEMA = pa.schema(
+    [
+        ("from_stop_name", pa.string()),
+        ("id", pa.string()),
+        ("name", pa.string()),
+        ("time", pa.int64()),
+        ("trans", pa.int64()),
+        ("lat", pa.float64()),
+        ("lon", pa.float64()),
+    ]
+)
+
+# destinations are serialized as records with the columns of DESTINATIONS_SCHEMA
+# (except from_stop_name), then the trailing lat and lon of every record are
+# combined into "coord": [lat, lon]
+COORD_PATTERN = re.compile(r'"lat":([^,]+),"lon":([^}]+)\}')
+
+
+def dataset_dir(day: str, time: str) -> Path:
+    return DATA_DIR / f"travel_times_proc_{day}_{time}_dataset"
+
+
+class DatasetWriter:
+    """Collect stops and their destinations and write them in row groups."""
+
+    def __init__(self, directory: Path, row_group_size: int = 100_000):
+        directory.mkdir(exist_ok=True)
+        self.row_group_size = row_group_size
+        self.stops_writer = pq.ParquetWriter(directory / "stops.parquet", STOPS_SCHEMA)
+        self.destinations_writer = pq.ParquetWriter(
+            directory / "destinations.parquet", DESTINATIONS_SCHEMA
+        )
+        self.stops = []
+        self.destinations = []
+        self.buffered_rows = 0
+
+    def add(self, stop_info: dict, destinations: Optional[pd.DataFrame] = None):
+        """
+        Add a stop. `destinations` has the columns of DESTINATIONS_SCHEMA except
+        from_stop_name.
+        """
+        lat, lon = stop_info["coord"]
+        self.stops.append((stop_info["name"], stop_info["id"], lat, lon))
+        if destinations is not None and len(destinations) > 0:
+            destinations = destinations.assign(from_stop_name=stop_info["name"])
+            self.destinations.append(destinations)
+            self.buffered_rows += len(destinations)
+            if self.buffered_rows >= self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        if self.stops:
+            stops = pd.DataFrame(self.stops, columns=STOPS_SCHEMA.names)
+            self.stops_writer.write_table(
+                pa.Table.from_pandas(stops, STOPS_SCHEMA, preserve_index=False)
+            )
+            self.stops = []
+        if self.destinations:
+            destinations = pd.concat(self.destinations, ignore_index=True)
+            self.destinations_writer.write_table(
+                pa.Table.from_pandas(
+                    destinations[DESTINATIONS_SCHEMA.names],
+                    DESTINATIONS_SCHEMA,
+                    preserve_index=False,
+                )
+            )
+            self.destinations = []
+        self.buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        self.stops_writer.close()
+        self.destinations_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_slot(
+    day: str, time: str, stop_names: list[str]
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Read the stops and destinations of a slot for the given origin stops."""
+    directory = dataset_dir(day, time)
+    stops = pq.read_table(
+        directory / "stops.parquet", filters=[("name", "in", stop_names)]
+    ).to_pandas()
+    destinations = pq.read_table(
+        directory / "destinations.parquet",
+        filters=[("from_stop_name", "in", stop_names)],
+    ).to_pandas()
+    return stops, destinations
+
+
+def read_stations(day: str, time: str, stop_names: list[str]) -> pd.DataFrame:
+    """Read the distinct destination stations (id, name, lat, lon) of a slot."""
+    return (
+        pq.read_table(
+            dataset_dir(day, time) / "destinations.parquet",
+            columns=["id", "name", "lat", "lon"],
+            filters=[("from_stop_name", "in", stop_names)],
+        )
+        .to_pandas()
+        .drop_duplicates()
+    )
+
+
+def destinations_json(destinations: pd.DataFrame) -> str:
+    """Serialize the destinations column-wise, without a Python object per row."""
+    records = destinations[DESTINATIONS_SCHEMA.names[1:]].to_json(
+        orient="records", force_ascii=False
+    )
+    return COORD_PATTERN.sub(r'"coord":[\1,\2]}', records)
+
+
+def destination_records(destinations: pd.DataFrame) -> list[str]:
+    """Serialize the destinations to one JSON object per row."""
+    lines = destinations[DESTINATIONS_SCHEMA.names[1:]].to_json(
+        orient="records", lines=True, force_ascii=False
+    )
+    lines = COORD_PATTERN.sub(r'"coord":[\1,\2]}', lines)
+    # JSON strings cannot contain raw line breaks
+    return lines.split("\n")[: len(destinations)]
@@ -0,0 +1,104 @@
+"""
+Index of stations (stops grouped by name) with their id, mean coordinate and
+whether they lie within an area.
+
+The index is built from the feed's stops.txt once per feed and area file and
+saved as .npy files, which later runs memory-map instead of reading the feed.
+The files are written to a temporary directory that is then renamed into
+place, so steps running in parallel never see a half-written index.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import geopandas as gp
+import numpy as np
+
+from gtfs_io import read_table
+from hashing import file_hash
+
+
+CACHE_DIR = Path("data/cache")
+
+FIELDS = ["names", "ids", "lats", "lons", "in_area"]
+
+
+class StationIndex:
+    """Station lookup by name over arrays sorted by name."""
+
+    def __init__(self, directory: Path):
+        for field in FIELDS:
+            array = np.load(directory / f"{field}.npy", mmap_mode="r")
+            setattr(self, field, np.asarray(array))
+
+    def position(self, stop_name: str) -> int:
+        i = np.searchsorted(self.names, stop_name)
+        if i == len(self.names) or self.names[i] != stop_name:
+            raise KeyError(stop_name)
+        return i
+
+    def stop_id(self, stop_name: str) -> str:
+        return str(self.ids[self.position(stop_name)])
+
+    def coord(self, stop_name: str) -> tuple[float, float]:
+        i = self.position(stop_name)
+        return float(self.lats[i]), float(self.lons[i])
+
+    def names_in_area(self) -> set[str]:
+        return set(self.names[self.in_area].tolist())
+
+
+def build_station_index(feed_file: Path, area_file: Path, directory: Path):
+    stops = read_table(
+        feed_file, "stops", usecols=["stop_id", "stop_name", "stop_lat", "stop_lon"]
+    )
+
+    # like gtfs_kit's get_stops_in_area
+    gdf_stops = gp.GeoDataFrame(
+        stops,
+        geometry=gp.points_from_xy(stops.stop_lon, stops.stop_lat),
+        crs="EPSG:4326",
+    )
+    gdf_area = gp.read_file(area_file).to_crs("EPSG:4326")
+    names_in_area = gp.sjoin(gdf_stops, gdf_area)["stop_name"].unique()
+
+    stations = stops.groupby("stop_name").aggregate(
+        stop_lat=("stop_lat", "mean"),
+        stop_lon=("stop_lon", "mean"),
+        # the id of the last stop with the name
+        stop_id=("stop_id", "last"),
+    )
+
+    directory.mkdir(parents=True, exist_ok=True)
+    arrays = {
+        "names": stations.index.to_numpy(dtype="str"),
+        "ids": stations["stop_id"].to_numpy(dtype="str"),
+        "lats": stations["stop_lat"].to_numpy(dtype="float64"),
+        "lons": stations["stop_lon"].to_numpy(dtype="float64"),
+        "in_area": stations.index.isin(names_in_area),
+    }
+    for field in FIELDS:
+        np.save(directory / f"{field}.npy", arrays[field])
+
+
+def station_index(feed_file: Path, area_file: Path) -> StationIndex:
+    """Open the station index for the feed and area, building it if necessary."""
+    directory = CACHE_DIR / (
+        f"station_index_{file_hash(feed_file)[:16]}_{file_hash(area_file)[:16]}"
+    )
+    if not directory.exists():
+        print(f"Building station index in {directory}")
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix=f".{directory.name}_", dir=CACHE_DIR))
+        try:
+            build_station_index(feed_file, area_file, tmp)
+            os.replace(tmp, directory)
+        except OSError:
+            # another process has moved its index into place first
+            if not directory.exists():
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return StationIndex(directory)
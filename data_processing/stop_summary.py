@@ -0,0 +1,136 @@
+"""
+Summary table of a directory of per-stop files, written next to it as
+<directory>_summary.csv (e.g. data/merged_summary.csv), so later steps can find
+dead stops without parsing every stop file.
+
+One row per stop file: the file name without extension, stop id, name,
+municipality and coordinates, the number of journeys of each day and time slot,
+the shortest travel time and the fewest transfers of all journeys, and whether
+the stop has no journey at all (dead).
+
+14_vbb.py and 15_google_maps.py only write the files of the stops they add
+journeys to, but their summaries cover all stops. A stop's current file is the
+one in the first directory of the chain that has it (see stop_file).
+"""
+
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+import ujson as json
+
+
+SLOTS = [
+    ("Werktag", "Tag"),
+    ("Werktag", "Nacht"),
+    ("Samstag", "Tag"),
+    ("Samstag", "Nacht"),
+    ("Sonntag", "Tag"),
+    ("Sonntag", "Nacht"),
+]
+
+COUNT_COLUMNS = [f"n_{day.lower()}_{time.lower()}" for day, time in SLOTS]
+
+COLUMNS = [
+    "file",
+    "stop_id",
+    "stop_name",
+    "municipality",
+    "lat",
+    "lon",
+    *COUNT_COLUMNS,
+    "min_time",
+    "min_trans",
+    "dead",
+]
+
+
+def summary_file(directory: Path) -> Path:
+    directory = Path(directory)
+    return directory.with_name(f"{directory.name}_summary.csv")
+
+
+def stop_file(file: str, directories: list) -> Path:
+    """The file named file.json in the first of the directories that has one."""
+    for directory in directories:
+        path = Path(directory) / f"{file}.json"
+        if path.exists():
+            return path
+    raise FileNotFoundError(f"No stop file {file}.json")
+
+
+def summary_row(file: str, stop_info: dict, counts, min_time, min_trans) -> dict:
+    return {
+        "file": file,
+        "stop_id": stop_info.get("id"),
+        "stop_name": stop_info["name"],
+        "municipality": stop_info.get("municipality"),
+        "lat": stop_info["coord"][0],
+        "lon": stop_info["coord"][1],
+        **dict(zip(COUNT_COLUMNS, counts)),
+        "min_time": min_time,
+        "min_trans": min_trans,
+        "dead": sum(counts) == 0,
+    }
+
+
+def summarize(file: str, data: dict) -> dict:
+    """Summarize a per-stop file (any format version) named file.json."""
+    destinations = [data["travelTimes"][day][time] for day, time in SLOTS]
+    return summary_row(
+        file,
+        data["stopInfo"],
+        [len(slot) for slot in destinations],
+        min((d["time"] for slot in destinations for d in slot), default=None),
+        min((d["trans"] for slot in destinations for d in slot), default=None),
+    )
+
+
+def stop_row(summary: pd.DataFrame, file: str) -> dict:
+    """The row of a stop in a summary read by read_summary."""
+    return {"file": file, **summary.loc[file].to_dict()}
+
+
+def write_summary(rows: Iterable[dict], directory: Path):
+    # stops sharing a name share a file, the last one written is kept
+    df = pd.DataFrame(list(rows), columns=COLUMNS)
+    df = df.drop_duplicates("file", keep="last").sort_values("file")
+    # times of journeys added by 14 and 15 are not always whole seconds
+    df["min_time"] = pd.to_numeric(df["min_time"]).round().astype("Int64")
+    df["min_trans"] = pd.to_numeric(df["min_trans"]).astype("Int64")
+    df.to_csv(summary_file(directory), index=False)
+
+
+def scan(directory: Path):
+    """Summarize every stop file of a directory by reading it."""
+    rows = []
+    for path in sorted(Path(directory).glob("*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            rows.append(summarize(path.stem, json.load(f)))
+    write_summary(rows, directory)
+
+
+def read_summary(directory: Path) -> pd.DataFrame:
+    """
+    Read the summary of a directory, indexed by file name. Directories written
+    before summaries existed are scanned once.
+    """
+    path = summary_file(directory)
+    if not path.exists():
+        print(f"No summary of {directory}, scanning the stop files...")
+        scan(directory)
+
+    return pd.read_csv(
+        path,
+        dtype={
+            "file": "string",
+            "stop_id": "string",
+            "stop_name": "string",
+            "municipality": "string",
+            "min_time": "Int64",
+            "min_trans": "Int64",
+        },
+        float_precision="round_trip",
+        keep_default_na=False,
+        na_values={"stop_id": [""], "min_time": [""], "min_trans": [""]},
+    ).set_index("file")
@@ -0,0 +1,122 @@
+"""
+Client for the VBB REST API (https://v5.vbb.transport.rest) that can be shared by
+threads.
+
+Every request takes a token from one bucket, which refills at a constant rate, so
+concurrent requests keep the API's rate limit (100 requests per minute) saturated
+without exceeding it. Requests answered with 429 or a 5xx status and requests
+that fail to connect are retried with exponential backoff. Other responses are
+stored in the request cache, if one is given (see request_cache.py).
+"""
+
+from random import random
+from threading import Lock, local
+from time import monotonic, sleep
+import sys
+
+import requests
+
+from request_cache import RequestCache
+
+
+VBB_URL = "https://v5.vbb.transport.rest"
+
+# with a burst of 10, no 60 s window sees more than 90 + 10 requests
+REQUESTS_PER_MINUTE = 90
+BURST = 10
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """Hold up to `capacity` tokens, refilled at `rate` tokens per second."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class VBBClient:
+    def __init__(
+        self,
+        base_url: str = VBB_URL,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        burst: int = BURST,
+        retries: int = 5,
+        backoff: float = 2.0,
+        timeout: float = 30.0,
+        cache: RequestCache = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.bucket = TokenBucket(requests_per_minute / 60, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.local = local()
+
+    def session(self) -> requests.Session:
+        """A session per thread, reusing its connections."""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def get(self, path: str, params: dict = None) -> requests.Response:
+        """
+        Request `path` (e.g. "/journeys"), or return the cached response.
+        Responses other than 429 and 5xx are returned as they are, as is the last
+        one when all retries fail.
+        """
+        url = self.base_url + path
+        if self.cache is not None:
+            cached = self.cache.get(url, params)
+            if cached is not None:
+                return cached
+
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self.session().get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                reason = type(e).__name__
+                delay = None
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    if self.cache is not None:
+                        self.cache.put(url, params, response)
+                    return response
+                if attempt == self.retries:
+                    return response
+                reason = response.status_code
+                delay = retry_after(response)
+
+            if delay is None:
+                # exponential backoff with jitter, so retries do not synchronize
+                delay = self.backoff * 2**attempt * (0.5 + random())
+            print(f"{reason}, retrying {path} in {delay:.1f} s", file=sys.stderr)
+            sleep(delay)
+
+
+def retry_after(response: requests.Response):
+    """The delay in seconds a response asks for, if any."""
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
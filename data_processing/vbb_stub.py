@@ -0,0 +1,174 @@
+"""
+Local stub of the VBB REST API endpoints used by 14_vbb.py, to run it without
+sending requests to https://v5.vbb.transport.rest:
+
+    python vbb_stub.py --port 8000
+    python 14_vbb.py wednesday day --base-url http://localhost:8000
+
+Journeys are made up deterministically from the stop ids. Some stop ids are
+unknown, so stops have to be looked up by name. Requests beyond the rate limit
+are answered with 429, and a share of the others fails with 503. The statistics
+of all requests are printed on exit.
+"""
+
+
+from argparse import ArgumentParser
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import parse_qs, urlparse
+import hashlib
+import json
+import random
+import signal
+
+
+TIMEZONE = timezone(timedelta(hours=1))
+
+
+def stable_hash(*values) -> int:
+    digest = hashlib.sha256("|".join(map(str, values)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def is_known(stop_id: str) -> bool:
+    return stable_hash("known", stop_id) % 5 != 0
+
+
+def journey(from_id: str, to_id: str, departure: int) -> dict:
+    h = stable_hash(from_id, to_id)
+    start = datetime.fromtimestamp(departure, TIMEZONE) + timedelta(minutes=h % 30)
+    n_legs = 1 + h % 3
+    leg_duration = timedelta(minutes=10 + h % 25)
+
+    legs = []
+    for i in range(n_legs):
+        legs.append(
+            {
+                "plannedDeparture": (start + i * leg_duration).isoformat(),
+                "plannedArrival": (start + (i + 1) * leg_duration).isoformat(),
+                # walk to the first stop now and then
+                "walking": i == 0 and n_legs > 1 and h % 2 == 0,
+            }
+        )
+    return {"legs": legs}
+
+
+class Stub:
+    def __init__(self, requests_per_minute: int, error_rate: float, latency: float):
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.latency = latency
+        self.lock = Lock()
+        self.recent = deque()
+        self.stats = Counter()
+        self.max_per_minute = 0
+
+    def admit(self) -> bool:
+        """Count a request against the limit of the last 60 s."""
+        with self.lock:
+            now = monotonic()
+            while self.recent and self.recent[0] <= now - 60:
+                self.recent.popleft()
+            if len(self.recent) >= self.requests_per_minute:
+                self.stats["429"] += 1
+                return False
+            self.recent.append(now)
+            self.max_per_minute = max(self.max_per_minute, len(self.recent))
+            return True
+
+    def respond(self, path: str, query: dict) -> tuple[int, dict]:
+        if not self.admit():
+            return 429, {"message": "too many requests"}
+        sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.error_rate:
+            self.stats["503"] += 1
+            return 503, {"message": "service unavailable"}
+        self.stats[path.split("/")[1]] += 1
+
+        if path == "/journeys":
+            from_id, to_id = query["from"][0], query["to"][0]
+            if not is_known(from_id) or not is_known(to_id):
+                return 404, {"message": "location/stop not found"}
+            return 200, {
+                "journeys": [journey(from_id, to_id, int(query["departure"][0]))]
+            }
+
+        if path.startswith("/stops/"):
+            stop_id = path[len("/stops/") :]
+            if not is_known(stop_id):
+                return 404, {"message": "location/stop not found"}
+            return 200, {"type": "stop", "id": stop_id}
+
+        if path == "/stations":
+            name = query["query"][0]
+            # a known id for every name
+            station_id = str(900_000_000 + stable_hash(name) % 1_000_000)
+            while not is_known(station_id):
+                station_id = str(int(station_id) + 1)
+            return 200, {station_id: {"id": station_id, "name": name, "score": 1.0}}
+
+        return 404, {"message": "not found"}
+
+
+def handler(stub: Stub):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            status, body = stub.respond(url.path, parse_qs(url.query))
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = ArgumentParser(description="Serve a stub of the VBB REST API.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--requests-per-minute",
+        type=int,
+        default=100,
+        help="rate limit (default: 100)",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.05,
+        help="share of requests failing with 503 (default: 0.05)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.3,
+        help="mean response time in seconds (default: 0.3)",
+    )
+    args = parser.parse_args()
+
+    stub = Stub(args.requests_per_minute, args.error_rate, args.latency)
+    server = ThreadingHTTPServer(("localhost", args.port), handler(stub))
+    print(f"Serving on http://localhost:{args.port}", flush=True)
+    # stop on kill as on Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(dict(stub.stats), "max requests per minute:", stub.max_per_minute)
+
+
+if __name__ == "__main__":
+    main()
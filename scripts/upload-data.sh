@@ -25,6 +25,16 @@ cd $(dirname $0)/..
 export $(cat .env | xargs)
 
 
+# stop files of format version 2 reference the stations in city_centres.json
+city_centres() {
+  [ -f data_processing/data/city_centres.json ] && cp data_processing/data/city_centres.json "$DATA_DIR"/
+
+  if [ ! -f "$DATA_DIR"/city_centres.json ] && grep -rlq '^{"version":2,' "$DATA_DIR"/stops; then
+    echo "$DATA_DIR"'/stops contains files of format version 2 but '"$DATA_DIR"'/city_centres.json is missing (written by data_processing/11_merging.py)' >&2
+    exit 1
+  fi
+}
+
 upload() {
   # destination folder in google cloud storage
   cloud_dst=gs:/"$base_path"
@@ -42,6 +52,7 @@ upload() {
 
 main() {
   base_path="$DATA_PATH"
+  city_centres
   upload
 }
 
@@ -16,6 +16,7 @@ import Map from './Map'
 import FAQ from './FAQ'
 import Contact from './Contact'
 import { format } from './util'
+import { fetchStop } from './stopData'
 
 const DAYS_LESS = ['Werktag', 'Samstag', 'Sonntag']
 
@@ -200,11 +201,7 @@ function App() {
 
     stop = stop.label
     const stopURLEncoded = encodeFileName(stop)
-    const responseStopData = await fetch(
-      `${process.env.REACT_APP_DATA_URL}/stops/${stopURLEncoded}.json`
-    )
-
-    const stopData = await responseStopData.json()
+    const stopData = await fetchStop(stopURLEncoded)
 
     selectedStopDispatch({ type: ACTION_TYPES.FETCH_SUCCESS, stop: stopData })
     window.location.hash = fixedEncodeURIComponent(stop)
@@ -0,0 +1,70 @@
+// Decoder for the compact binary stop files written by data_processing/payload.py.
+// The arrays are read as typed array views on the buffer (little endian, like all
+// platforms browsers run on)
+const MAGIC = 'RWCB'
+const VERSION = 1
+
+const SLOTS = [
+  ['Werktag', 'Tag'],
+  ['Werktag', 'Nacht'],
+  ['Samstag', 'Tag'],
+  ['Samstag', 'Nacht'],
+  ['Sonntag', 'Tag'],
+  ['Sonntag', 'Nacht']
+]
+
+const COORD_SCALE = 1e6
+
+const FLAG_WALKING = 1
+
+export function decodePayload(buffer) {
+  const view = new DataView(buffer)
+  if (String.fromCharCode(...new Uint8Array(buffer, 0, 4)) !== MAGIC) {
+    throw new Error('Not a stop payload')
+  }
+  const version = view.getUint16(4, true)
+  if (version !== VERSION) throw new Error(`Unsupported payload version ${version}`)
+  const headerLength = view.getUint32(8, true)
+
+  let offset = 12
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, offset, headerLength)))
+  offset += headerLength
+
+  const take = (ArrayType, length) => {
+    const array = new ArrayType(buffer, offset, length)
+    offset += array.byteLength
+    return array
+  }
+
+  const stations = header.stations
+  const coords = take(Int32Array, 2 * stations.length)
+  const counts = take(Uint32Array, SLOTS.length)
+  const n = counts.reduce((a, b) => a + b, 0)
+  const refs = take(Uint16Array, n)
+  const times = take(Uint16Array, n)
+  const transfers = take(Uint8Array, n)
+  const flags = take(Uint8Array, n)
+
+  const travelTimes = {}
+  let start = 0
+  SLOTS.forEach(([day, time], slot) => {
+    const destinations = []
+    for (let i = start; i < start + counts[slot]; i++) {
+      const ref = refs[i]
+      const destination = {
+        id: stations[ref][0],
+        name: stations[ref][1],
+        time: times[i],
+        trans: transfers[i],
+        coord: [coords[2 * ref] / COORD_SCALE, coords[2 * ref + 1] / COORD_SCALE]
+      }
+      if (flags[i] & FLAG_WALKING) destination.walking = true
+      destinations.push(destination)
+    }
+    travelTimes[day] = travelTimes[day] || {}
+    travelTimes[day][time] = destinations
+    start += counts[slot]
+  })
+
+  return { stopInfo: header.stopInfo, travelTimes }
+}
@@ -0,0 +1,56 @@
+import { decodePayload } from './payload'
+
+// Per-stop files of format version 2 reference city centre stations by their index
+// in city_centres.json instead of repeating id, name and coordinates in every journey
+const FORMAT_VERSION = 2
+
+let cityCentres = null
+
+function fetchCityCentres() {
+  if (!cityCentres) {
+    cityCentres = fetch(`${process.env.REACT_APP_DATA_URL}/city_centres.json`)
+      .then((response) => response.json())
+      .catch((error) => {
+        cityCentres = null
+        throw error
+      })
+  }
+  return cityCentres
+}
+
+function decodeDestination(destination, centres) {
+  if (destination?.ref === undefined) return destination
+  const { ref, ...rest } = destination
+  const centre = centres[ref]
+  return { id: centre.id, name: centre.name, ...rest, coord: centre.coord }
+}
+
+function decodeTravelTimes(value, centres) {
+  if (Array.isArray(value)) return value.map((d) => decodeDestination(d, centres))
+  if (value && typeof value === 'object') {
+    return Object.fromEntries(
+      Object.entries(value).map(([key, v]) => [key, decodeTravelTimes(v, centres)])
+    )
+  }
+  return value
+}
+
+// Expand the city centre references of a stop file, other files are returned as is
+export async function decodeStop(stopData) {
+  if (stopData.version !== FORMAT_VERSION) return stopData
+
+  const centres = await fetchCityCentres()
+  const { version, ...rest } = stopData
+  return { ...rest, travelTimes: decodeTravelTimes(stopData.travelTimes, centres) }
+}
+
+// Fetch and decode a stop file, as compact binary if REACT_APP_STOP_FORMAT=binary
+export async function fetchStop(fileName) {
+  const url = `${process.env.REACT_APP_DATA_URL}/stops/${fileName}`
+  if (process.env.REACT_APP_STOP_FORMAT === 'binary') {
+    const response = await fetch(`${url}.bin`)
+    return decodePayload(await response.arrayBuffer())
+  }
+  const response = await fetch(`${url}.json`)
+  return decodeStop(await response.json())
+}